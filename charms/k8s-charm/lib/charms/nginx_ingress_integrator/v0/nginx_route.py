@@ -78,6 +78,9 @@ import ops.charm
 import ops.framework
 import ops.model
 
+# Patched: databags are only written when their contents change.
+from charms.juju_dashboard.v0.juju_dashboard import update_databag
+
 # The unique Charmhub library identifier, never change it
 LIBID = "3c212b6ed3cf43dfbf9f2e322e634beb"
 
@@ -159,15 +162,11 @@ class NginxRouteRequirer(ops.framework.Object):
         if not self._charm.model.unit.is_leader():
             return
         for relation in self._charm.model.relations[self._nginx_route_relation_name]:
-            relation_app_data = relation.data[self._charm.app]
-            delete_keys = {
-                relation_field
-                for relation_field in relation_app_data
-                if relation_field not in self.config
-            }
-            for delete_key in delete_keys:
-                del relation_app_data[delete_key]
-            relation_app_data.update({k: str(v) for k, v in self.config.items()})
+            update_databag(
+                relation.data[self._charm.app],
+                {k: str(v) for k, v in self.config.items()},
+                clear=True,
+            )
 
 
 # C901 is ignored since the method has too many ifs but wouldn't be
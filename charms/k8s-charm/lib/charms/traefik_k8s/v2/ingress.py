@@ -78,6 +78,9 @@ from ops.framework import EventSource, Object, ObjectEvents, StoredState
 from ops.model import ModelError, Relation, Unit
 from pydantic import AnyHttpUrl, BaseModel, Field
 
+# Patched: databags are only written when their contents change.
+from charms.juju_dashboard.v0.juju_dashboard import update_databag
+
 # The unique Charmhub library identifier, never change it
 LIBID = "e6de2a5cd5b34422a204668f3b8f90d2"
 
@@ -146,19 +149,17 @@ if PYDANTIC_IS_V1:  # noqa
             :param databag: the databag to write the data to.
             :param clear: ensure the databag is cleared before writing it.
             """
-            if clear and databag:
-                databag.clear()
-
-            if databag is None:
-                databag = {}
-
             if self._NEST_UNDER:
-                databag[self._NEST_UNDER] = self.json(by_alias=True, exclude_defaults=True)
-                return databag
-
-            for key, value in self.dict(by_alias=True, exclude_defaults=True).items():  # type: ignore  # noqa
-                databag[key] = json.dumps(value)
+                data = {self._NEST_UNDER: self.json(by_alias=True, exclude_defaults=True)}
+            else:
+                data = {
+                    key: json.dumps(value)
+                    for key, value in self.dict(by_alias=True, exclude_defaults=True).items()  # type: ignore  # noqa
+                }
 
+            if databag is None:
+                return data
+            update_databag(databag, data, clear=clear)
             return databag
 
 else:
@@ -214,26 +215,26 @@ else:
             :param databag: the databag to write the data to.
             :param clear: ensure the databag is cleared before writing it.
             """
-            if clear and databag:
-                databag.clear()
-
-            if databag is None:
-                databag = {}
             nest_under = self.model_config.get("_NEST_UNDER")
             if nest_under:
-                databag[nest_under] = self.model_dump_json(  # type: ignore
+                data = {
+                    nest_under: self.model_dump_json(  # type: ignore
+                        by_alias=True,
+                        # skip keys whose values are default
+                        exclude_defaults=True,
+                    )
+                }
+            else:
+                dct = self.model_dump(
+                    mode="json",
                     by_alias=True,
-                    # skip keys whose values are default
-                    exclude_defaults=True,
+                    exclude_defaults=True,  # type: ignore
                 )
-                return databag
+                data = {k: json.dumps(v) for k, v in dct.items()}
 
-            dct = self.model_dump(
-                mode="json",
-                by_alias=True,
-                exclude_defaults=True,  # type: ignore
-            )
-            databag.update({k: json.dumps(v) for k, v in dct.items()})
+            if databag is None:
+                return data
+            update_databag(databag, data, clear=clear)
             return databag
 
 
@@ -4,11 +4,17 @@
 #
 # Learn more at: https://juju.is/docs/sdk
 
+import hashlib
 import logging
+import time
 from pathlib import Path
 from urllib.parse import urlsplit
 
-from charms.juju_dashboard.v0.juju_dashboard import JujuDashData, JujuDashReq
+from charms.juju_dashboard.v0.juju_dashboard import (
+    JujuDashData,
+    JujuDashReq,
+    update_databag,
+)
 from charms.nginx_ingress_integrator.v0.nginx_route import require_nginx_route
 from charms.traefik_k8s.v2.ingress import (
     IngressPerAppReadyEvent,
@@ -16,13 +22,60 @@ from charms.traefik_k8s.v2.ingress import (
     IngressPerAppRevokedEvent,
 )
 from ops.charm import CharmBase, RelationEvent
+from ops.framework import StoredState
 from ops.main import main
 from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus
+from ops.pebble import (
+    APIError,
+    ChangeError,
+    CheckLevel,
+    CheckStatus,
+    ExecError,
+    PathError,
+)
 
-from config import Config, to_bool
+from config import (
+    ARTIFACTS,
+    CGROUP_CPU_MAX,
+    CGROUP_CPUSET,
+    CGROUP_MEMORY_MAX,
+    CONFIG_JS,
+    CONTROLLER_CA,
+    CONTROLLER_CA_PATH,
+    INDEX_HTML,
+    NGINX_CONF,
+    NGINX_MAIN_CONF,
+    TEMPLATES,
+    VITE_MANIFEST,
+    Config,
+    cpuset_size,
+    stale_config_names,
+    to_bool,
+    upstream_server,
+    worker_settings,
+)
+from delivery import FileDelivery
+from probe import LatencyProbe
+from reconcile import Reconciler
 
 logger = logging.getLogger(__name__)
 
+# The charm's templates. The index template and build manifest are fetched from the
+# workload image into the same directory.
+CONFIG_DIR = Path(__file__).parent.resolve()
+DASHBOARD_ROOT = "/srv"
+# Where each generated artifact is served from in the workload container. config.js is
+# named by the hash of its content.
+WORKLOAD_PATHS = {
+    INDEX_HTML: f"{DASHBOARD_ROOT}/index.html",
+    NGINX_CONF: "/etc/nginx/sites-available/default",
+    NGINX_MAIN_CONF: "/etc/nginx/nginx.conf",
+    CONTROLLER_CA: CONTROLLER_CA_PATH,
+}
+# Pebble checks that nginx responds, and Kubernetes only sends traffic to the unit while
+# it does.
+READY_CHECK = "nginx-ready"
+
 
 class JujuDashboardKubernetesCharm(CharmBase):
     """Juju Dashboard Kubernetes Charm
@@ -35,35 +88,63 @@ class JujuDashboardKubernetesCharm(CharmBase):
     - The controller relation allows the dashboard to connect to a Juju controller.
     - The dashboard relation allows an http proxy to connect to the dashboard charm.
 
-    Note: This charm will not add the dashboard layers to the workload until a relation to
-    the controller is established.
+    Note: The dashboard is served as soon as the workload container is ready. Until the
+    controller provides its URL, nothing is proxied and the app reports that it isn't
+    configured yet. The workload is then updated in place.
 
     """
 
+    _stored = StoredState()
+
     def __init__(self, *args):
         super().__init__(*args)
 
         self.framework.observe(self.on.install, self._on_install)
+        self.framework.observe(
+            self.on["dashboard"].pebble_ready, self._on_dashboard_pebble_ready
+        )
 
         self.framework.observe(
             self.on["controller"].relation_changed,
             self._on_controller_relation_changed,
         )
         self.framework.observe(
-            self.on["controller"].relation_departed,
-            self._on_relation_departed,
+            self.on["controller"].relation_departed, self._on_model_changed
+        )
+        self.framework.observe(
+            self.on["controller"].relation_broken, self._on_model_changed
         )
         self.framework.observe(
             self.on["dashboard"].relation_changed,
             self._on_dashboard_relation_changed,
         )
         self.framework.observe(
-            self.on["dashboard"].relation_departed,
-            self._on_relation_departed,
+            self.on["dashboard"].relation_departed, self._on_model_changed
         )
         self.framework.observe(self.on.config_changed, self._on_config_changed)
-        self.framework.observe(self.on.update_status, self._on_config_changed)
-        self.framework.observe(self.on.upgrade_charm, self._on_config_changed)
+        self.framework.observe(self.on.update_status, self._on_update_status)
+        self.framework.observe(self.on.upgrade_charm, self._on_upgrade_charm)
+        self.framework.observe(
+            self.on["dashboard"].pebble_check_failed, self._on_dashboard_check_changed
+        )
+        self.framework.observe(
+            self.on["dashboard"].pebble_check_recovered,
+            self._on_dashboard_check_changed,
+        )
+        self.framework.observe(
+            self.on.reconcile_stats_action, self._on_reconcile_stats_action
+        )
+
+        self._stored.set_default(
+            index_template_digest=None,
+            index_template_fetched=False,
+            brotli_static=False,
+            cgroup_limits={},
+            superseded_configs={},
+        )
+        self.reconciler = Reconciler(self)
+        self.latency_probe = LatencyProbe(self)
+        self.delivery = FileDelivery(self)
 
         require_nginx_route(
             charm=self,
@@ -71,106 +152,490 @@ class JujuDashboardKubernetesCharm(CharmBase):
             service_name=self.app.name,
             service_port=self.config.get("port"),
         )
-        self.ingress = IngressPerAppRequirer(self, port=self.config.get("port"))
+        # Traefik removes the base URL from the path, so that nginx can route requests
+        # without it.
+        self.ingress = IngressPerAppRequirer(
+            self,
+            port=self.config.get("port"),
+            strip_prefix=True,
+            healthcheck_params=self._healthcheck_params(),
+        )
         self.framework.observe(self.ingress.on.ready, self._on_ingress_ready)
         self.framework.observe(self.ingress.on.revoked, self._on_ingress_revoked)
 
+    def _healthcheck_params(self):
+        """Have Traefik stop sending requests to the unit if nginx stops responding."""
+        if not self.config.get("health-check-path"):
+            return None
+        return {
+            "path": self.config.get("health-check-path"),
+            "interval": f"{self.config.get('health-check-interval')}s",
+            "timeout": f"{self.config.get('health-check-timeout')}s",
+        }
+
     def _on_install(self, _):
         self.unit.status = MaintenanceStatus("Awaiting controller relation.")
 
     def _on_dashboard_relation_changed(self, event):
         """When something relates to the dashboard, tell it the port the service is avilable on."""
-        event.relation.data[self.app]["port"] = self.config.get("port")
-        event.relation.data[self.unit]["port"] = self.config.get("port")
-
-    def _on_relation_departed(self, event: RelationEvent):
-        self.unit.status = BlockedStatus("Missing controller integration")
+        port = str(self.config.get("port"))
+        if self.unit.is_leader():
+            update_databag(event.relation.data[self.app], {"port": port})
+        update_databag(event.relation.data[self.unit], {"port": port})
 
     def _on_controller_relation_changed(self, event: RelationEvent):
         """A controller relation has been setup; configure our workload."""
-        requires = JujuDashReq(self, event.relation, event.app)
-        if not requires.data["controller_url"]:
-            self.unit.status = BlockedStatus("Missing controller URL")
-            return
+        JujuDashReq(self, event.relation, event.app)
+        self._reconcile()
 
-        self._update(event, **requires.data)
+    def _on_model_changed(self, _):
+        """Reconcile the workload with the model, e.g. when a controller unit departs."""
+        self._reconcile()
 
-    def _update_using_relation(self, event):
-        relation = self.model.get_relation("controller")
-        if not relation:
-            self.unit.status = BlockedStatus("Missing controller integration")
+    def _reconcile(self):
+        """Update the workload from the model's current state, if it has changed.
+
+        The state is read from the model rather than the event, so every event in a burst
+        sees the same state and only the first one updates the workload.
+        """
+        data = self._controller_data()
+        base_app_url = None
+        if self.ingress is not None and self.ingress.url is not None:
+            base_app_url = urlsplit(self.ingress.url).path
+        state = {
+            "config": dict(self.config),
+            "related": self.model.get_relation("controller") is not None,
+            "controller": dict(data),
+            "base_app_url": base_app_url,
+        }
+        # Controller units are probed again once their measurements expire.
+        servers = self._probed_servers(data["controller_urls"], data["is_juju"])
+        if not self.reconciler.coalesce(
+            state, force=self.latency_probe.expired(servers)
+        ):
             return
+        self._update(base_app_url=base_app_url, **data)
 
-        data = JujuDashData(relation.data[relation.app])
-        self._update(event, **data)
+    def _controller_data(self):
+        """Return the data that the controller provides, which is empty until it is related."""
+        relation = self.model.get_relation("controller")
+        if not relation:
+            return JujuDashData({})
+        return JujuDashData(
+            relation.data[relation.app],
+            [relation.data[unit] for unit in relation.units],
+        )
 
     def _on_config_changed(self, event):
+        self.ingress.healthcheck_params = self._healthcheck_params()
         self.ingress.provide_ingress_requirements(port=self.config.get("port"))
-        self._update_using_relation(event)
+        self._reconcile()
+
+    def _on_update_status(self, event):
+        # Previous versions of config.js are removed once they have been superseded for
+        # long enough, even if nothing has changed since.
+        container = self.unit.get_container("dashboard")
+        if self._stored.superseded_configs and container.can_connect():
+            self._remove_stale_configs(container)
+        self._on_config_changed(event)
+
+    def _on_upgrade_charm(self, event):
+        # The workload container is recreated during an upgrade, so the files that were
+        # previously pushed to it no longer exist and the image may have changed.
+        self._stored.index_template_fetched = False
+        self._stored.superseded_configs = {}
+        self.reconciler.invalidate("the charm was upgraded")
+        self.delivery.invalidate()
+        self._on_config_changed(event)
+
+    def _on_dashboard_pebble_ready(self, event):
+        # The container has (re)started, possibly from a different image.
+        self._stored.index_template_fetched = False
+        self._stored.superseded_configs = {}
+        self.reconciler.invalidate("the dashboard container has started")
+        self.delivery.invalidate()
+        self._reconcile()
+
+    def _on_dashboard_check_changed(self, event):
+        if event.info.name == READY_CHECK:
+            self.unit.status = self._workload_status(event.workload)
+
+    def _on_reconcile_stats_action(self, event):
+        avoided = self.reconciler.avoided
+        event.set_results({"avoided": sum(avoided.values()), **avoided})
 
     def _on_ingress_ready(self, event: IngressPerAppReadyEvent):
-        self._update_using_relation(event)
+        self._reconcile()
 
     def _on_ingress_revoked(self, event: IngressPerAppRevokedEvent):
-        self._update_using_relation(event)
-
-    def _update(self, event, controller_url, identity_provider_url, is_juju):
-        base_app_url: str | None = None
-        if self.ingress is not None and self.ingress.url is not None:
-            base_app_url = urlsplit(self.ingress.url).path
-        config_dir = Path(__file__).parent.resolve()
+        self._reconcile()
+
+    def _update(
+        self,
+        base_app_url,
+        controller_url,
+        controller_urls,
+        controller_ca_cert,
+        identity_provider_url,
+        is_juju,
+    ):
+        config_dir = CONFIG_DIR
         container = self.unit.get_container("dashboard")
-        template = container.pull("/srv/index.charm.html").read()
-        local_template = config_dir / "index.charm.html"
-        local_template.write_text(template)
+        if not self._inspect_workload(container, config_dir):
+            self._wait_for_container()
+            return
         config = Config(
             base_app_url="" if base_app_url is None else base_app_url,
+            strip_prefix=True,
             config_dir=str(config_dir),
             controller_url=controller_url,
+            controller_urls=controller_urls,
+            controller_latencies=self._controller_latencies(controller_urls, is_juju),
+            proxy_connect_timeout=self.config.get("proxy-connect-timeout"),
+            proxy_read_timeout=self.config.get("proxy-read-timeout"),
+            proxy_send_timeout=self.config.get("proxy-send-timeout"),
+            proxy_buffering=self.config.get("proxy-buffering"),
+            proxy_tcp_nodelay=self.config.get("proxy-tcp-nodelay"),
+            proxy_socket_keepalive=self.config.get("proxy-socket-keepalive"),
+            controller_ca_cert=controller_ca_cert,
             identity_provider_url=identity_provider_url,
             is_juju=to_bool(is_juju),
             analytics_enabled=to_bool(self.config.get("analytics-enabled")),
-            dashboard_root="/srv",
+            dashboard_root=DASHBOARD_ROOT,
             port=self.config.get("port"),
+            compression_level=self.config.get("compression-level"),
+            static_gzip_level=self.config.get("static-gzip-level"),
+            static_brotli_level=self._static_brotli_level(),
+            inline_config=self.config.get("inline-config"),
+            workers=self._workers(),
+            multi_accept=self.config.get("multi-accept"),
+            reuseport=self.config.get("reuseport"),
+            sendfile=self.config.get("sendfile"),
+            tcp_nopush=self.config.get("tcp-nopush"),
+            keepalive_timeout=self.config.get("keepalive-timeout"),
+            keepalive_requests=self.config.get("keepalive-requests"),
+            open_file_cache_max=self.config.get("open-file-cache-max"),
+            open_file_cache_valid=self.config.get("open-file-cache-valid"),
+            open_file_cache_min_uses=self.config.get("open-file-cache-min-uses"),
+            aio_threads=self.config.get("aio-threads"),
+            health_check_path=self.config.get("health-check-path"),
+            reload_drain_timeout=self.config.get("reload-drain-timeout"),
         )
-        dashboard_config, nginx_config, index_html = config.generate()
+        pebble_layer = self._pebble_layer()
+        # nginx only needs to be restarted when its service changes.
+        layer = {
+            "service": pebble_layer["services"]["dashboard"],
+            "checks": pebble_layer["checks"],
+        }
+        inputs = {**config.inputs(), **layer}
+        changed = self.reconciler.changed_inputs(inputs)
+        if not changed:
+            self.reconciler.applied(inputs, {})
+            self.unit.status = self._workload_status(container)
+            return
+
+        outputs = config.render([name for name in changed if name in ARTIFACTS])
+        outputs.update({name: layer[name] for name in changed if name in layer})
+        changed = self.reconciler.changed_outputs(outputs)
+        if not changed:
+            self.reconciler.applied(inputs, outputs)
+            self.unit.status = self._workload_status(container)
+            return
+
         if not container.can_connect():
-            event.defer()
-            self.unit.status = MaintenanceStatus("Waiting for container.")
+            self._wait_for_container()
             return
 
-        self._configure(container, dashboard_config, nginx_config, index_html)
+        # There is no config.js when it is inlined in index.html.
+        config_js_name = None if CONFIG_JS not in inputs else config.config_js_name()
+        paths = {
+            **WORKLOAD_PATHS,
+            CONFIG_JS: f"{DASHBOARD_ROOT}/{config_js_name}",
+        }
+        # config.js is pushed before the index.html that refers to it.
+        files = {paths[name]: outputs[name] for name in changed if name in ARTIFACTS}
+        # The layer that was rendered is compared rather than Pebble's plan, as Pebble
+        # normalises values such as durations, so the plan never matches it exactly.
+        layer_changes = {name for name in changed if name in layer}
+        error = self._configure(
+            container, pebble_layer, layer_changes, files, config_js_name
+        )
+        if error:
+            self.unit.status = BlockedStatus(error)
+            return
+        self.reconciler.applied(inputs, outputs)
 
-        self.unit.status = ActiveStatus()
+        self.unit.status = self._workload_status(container)
 
-    def _configure(self, container, dashboard_config, nginx_config, index_html):
+    def _wait_for_container(self):
+        """Leave the workload to be configured when the container is ready.
+
+        The event isn't deferred, as it would be run again at the start of every hook
+        until the container is ready. The dashboard's pebble-ready event reconciles the
+        whole workload instead.
         """
-        Add and configure our pebble layer.
+        self.reconciler.avoid("container-unavailable")
+        self.unit.status = MaintenanceStatus("Waiting for container.")
+
+    def _inspect_workload(self, container, config_dir):
+        """Inspect the workload image and the container that it runs in.
 
-        Adds a working nodejs server to our container.
+        The index template and build manifest are fetched, and the nginx modules and
+        cgroup limits are recorded. These only change with the image or container, so
+        they are only fetched again after an upgrade or when the container restarts.
+        Returns whether they are available.
         """
+        local_template = config_dir / TEMPLATES[INDEX_HTML]
+        if self._stored.index_template_fetched and local_template.exists():
+            return True
+        if not container.can_connect():
+            return False
+        try:
+            template = container.pull("/srv/index.charm.html").read()
+        except PathError:
+            logger.info("The index template is not in the workload container yet.")
+            return False
+        digest = hashlib.sha256(template.encode()).hexdigest()
+        if digest != self._stored.index_template_digest or not local_template.exists():
+            logger.info("Updating the index template from the workload image.")
+            local_template.write_text(template)
+        self._stored.index_template_digest = digest
+        # The build manifest lists the modules that the index template should preload.
+        local_manifest = config_dir / VITE_MANIFEST
+        try:
+            manifest = container.pull(f"{DASHBOARD_ROOT}/{VITE_MANIFEST}").read()
+        except PathError:
+            local_manifest.unlink(missing_ok=True)
+        else:
+            local_manifest.parent.mkdir(exist_ok=True)
+            local_manifest.write_text(manifest)
+        try:
+            brotli_modules = container.list_files(
+                "/etc/nginx/modules-enabled", pattern="*brotli*"
+            )
+        except (APIError, PathError):
+            brotli_modules = []
+        self._stored.brotli_static = bool(brotli_modules)
+        # nginx is sized for the limits of the workload container, not the charm's.
+        cgroup_limits = {}
+        for name, path in (
+            ("cpu_max", CGROUP_CPU_MAX),
+            ("memory_max", CGROUP_MEMORY_MAX),
+            ("cpuset", CGROUP_CPUSET),
+        ):
+            try:
+                cgroup_limits[name] = container.pull(path).read()
+            except (APIError, PathError):
+                cgroup_limits[name] = None
+        self._stored.cgroup_limits = cgroup_limits
+        self._stored.index_template_fetched = True
+        return True
+
+    def _probed_servers(self, controller_urls, is_juju):
+        """Return the controller units that nginx proxies to."""
+        if not to_bool(is_juju):
+            return []
+        return [upstream_server(url) for url in controller_urls]
+
+    def _controller_latencies(self, controller_urls, is_juju):
+        """Measure the latency to each controller unit that nginx proxies to."""
+        return self.latency_probe.measure(
+            self._probed_servers(controller_urls, is_juju)
+        )
+
+    def _workers(self):
+        """Size the nginx workers for the CPUs and memory that the workload can use.
+
+        The CPUs are counted in the workload container's cgroup, as the charm's own
+        container may be given different CPUs.
+        """
+        return worker_settings(
+            self._stored.cgroup_limits.get("cpu_max"),
+            self._stored.cgroup_limits.get("memory_max"),
+            cpuset_size(self._stored.cgroup_limits.get("cpuset")),
+            processes=self.config.get("worker-processes"),
+            connections=self.config.get("worker-connections"),
+            rlimit_nofile=self.config.get("worker-rlimit-nofile"),
+        )
 
-        pebble_layer = {
+    def _static_brotli_level(self):
+        """Only compress with brotli if nginx is able to serve the compressed files."""
+        if not self._stored.brotli_static:
+            return 0
+        return self.config.get("static-brotli-level")
+
+    def _pebble_layer(self):
+        service = {
+            "override": "replace",
+            "summary": "dashboard",
+            "command": "/srv/entrypoint",
+            "startup": "enabled",
+            # How long Pebble waits before starting nginx again after it has exited.
+            "backoff-delay": f"{self.config.get('restart-backoff-delay')}s",
+            "backoff-factor": self.config.get("restart-backoff-factor"),
+            "backoff-limit": f"{self.config.get('restart-backoff-limit')}s",
+            "environment": {
+                # The static assets are compressed when the container starts.
+                "DASHBOARD_STATIC_GZIP_LEVEL": str(
+                    self.config.get("static-gzip-level")
+                ),
+                "DASHBOARD_STATIC_BROTLI_LEVEL": str(self._static_brotli_level()),
+            },
+        }
+        layer = {
             "summary": "dashboard layer",
             "description": "pebble config layer for dashboard",
-            "services": {
-                "dashboard": {
-                    "override": "replace",
-                    "summary": "dashboard",
-                    "command": "/srv/entrypoint",
-                    "startup": "enabled",
-                    "environment": {},
-                }
-            },
+            "services": {"dashboard": service},
         }
+        health_check_path = self.config.get("health-check-path")
+        if health_check_path:
+            # nginx is restarted if it stops responding.
+            service["on-check-failure"] = {READY_CHECK: "restart"}
+        # Combining layers never removes a check, so a check that was added before is
+        # disabled rather than left out when health checks are turned off.
+        layer["checks"] = {
+            READY_CHECK: {
+                "override": "replace",
+                "level": "ready",
+                "startup": "enabled" if health_check_path else "disabled",
+                "period": f"{self.config.get('health-check-interval')}s",
+                "timeout": f"{self.config.get('health-check-timeout')}s",
+                "threshold": self.config.get("health-check-threshold"),
+                "http": {
+                    "url": f"http://localhost:{self.config.get('port')}"
+                    f"{health_check_path or '/'}"
+                },
+            }
+        }
+        return layer
+
+    def _workload_status(self, container):
+        """Return the unit's status, which is only active while nginx is responding."""
+        if not container.can_connect() or not self.config.get("health-check-path"):
+            # Without health checks, the status of a check that has been stopped is stale.
+            return self._controller_status()
+        try:
+            checks = container.get_checks(level=CheckLevel.READY)
+        except APIError as error:
+            logger.warning("Could not get the status of the health checks: %s", error)
+            return self._controller_status()
+        if any(check.status != CheckStatus.UP for check in checks.values()):
+            return MaintenanceStatus("Waiting for nginx to respond to health checks.")
+        return self._controller_status()
+
+    def _controller_status(self):
+        """Return the unit's status while nginx is serving the dashboard."""
+        if not self.model.get_relation("controller"):
+            return BlockedStatus("Missing controller integration")
+        if not self._controller_data()["controller_url"]:
+            return BlockedStatus("Missing controller URL")
+        return ActiveStatus()
+
+    def _configure(self, container, pebble_layer, layer_changes, files, config_js_name):
+        """
+        Add and configure our pebble layer.
+
+        Adds a working nginx server to our container and pushes the files that have
+        changed, which are provided as a mapping of paths to their contents, and removes
+        previous versions of config.js once they are no longer needed. `layer_changes`
+        names the parts of the layer that changed, "service" and "checks". nginx is only
+        restarted when its service changed or it isn't running. Otherwise it is only
+        reloaded if its own config changed, as config.js and index.html are served from
+        disk. The new config is validated first and nginx is reloaded gracefully, so that
+        open websockets to the controller are not dropped. An invalid config is not
+        loaded, leaving nginx serving the previous one.
+
+        Returns why nginx is not running with the new config, or None if it is.
+        """
         container.add_layer("dashboard", pebble_layer, combine=True)
 
-        container.push("/srv/config.js", dashboard_config)
-        container.push("/srv/index.html", index_html)
-        container.push("/etc/nginx/sites-available/default", nginx_config)
+        delivered = self.delivery.deliver(container, files)
+        if WORKLOAD_PATHS[INDEX_HTML] in files:
+            self._supersede_configs(container, config_js_name)
+        self._remove_stale_configs(container)
+        nginx_config = {
+            WORKLOAD_PATHS[NGINX_CONF],
+            WORKLOAD_PATHS[NGINX_MAIN_CONF],
+            CONTROLLER_CA_PATH,
+        }
+        reload = nginx_config & set(delivered)
+
+        try:
+            if "checks" in layer_changes and not self.config.get("health-check-path"):
+                # Replanning doesn't start a disabled check, but doesn't stop it either.
+                if container.get_checks(READY_CHECK):
+                    container.stop_checks(READY_CHECK)
+            running = container.get_service("dashboard").is_running()
+            if "service" in layer_changes or not running:
+                logger.info("Restarting nginx as the pebble layer has changed.")
+                container.replan()
+                container.restart("dashboard")
+                return None
+            if "checks" in layer_changes:
+                # Replanning applies the checks without restarting the unchanged service.
+                container.replan()
+            if not reload:
+                logger.info("Not reloading nginx as its config is unchanged.")
+            elif self._validate_nginx(container):
+                logger.info("Reloading nginx.")
+                container.send_signal("SIGHUP", "dashboard")
+            else:
+                # Push the config again on the next attempt so that it is revalidated.
+                self.delivery.invalidate()
+                return "Invalid nginx config"
+        except (APIError, ChangeError) as error:
+            logger.error("Could not start nginx: %s", error)
+            return "Could not start nginx"
+        return None
+
+    def _supersede_configs(self, container, config_js_name):
+        """Record when index.html stopped referring to each previous version of config.js.
+
+        The time is recorded in StoredState rather than taken from the file, as a version
+        that is used again isn't pushed again, so its modification time is stale.
+        """
+        now = time.time()
+        superseded = {
+            name: since
+            for name, since in self._stored.superseded_configs.items()
+            if name != config_js_name
+        }
+        for file in container.list_files(DASHBOARD_ROOT, pattern="config.*.js"):
+            if file.name != config_js_name:
+                superseded.setdefault(file.name, now)
+        self._stored.superseded_configs = superseded
+
+    def _remove_stale_configs(self, container):
+        """Remove previous versions of config.js once browsers no longer need them.
+
+        A browser may have loaded the previous index.html just before it was replaced,
+        so each version is kept for a while after it is superseded.
+        """
+        existing = {
+            file.name
+            for file in container.list_files(DASHBOARD_ROOT, pattern="config.*.js")
+        }
+        superseded = {
+            name: since
+            for name, since in self._stored.superseded_configs.items()
+            if name in existing
+        }
+        stale = stale_config_names(
+            superseded, time.time(), self.config.get("open-file-cache-valid")
+        )
+        self.delivery.remove(container, [f"{DASHBOARD_ROOT}/{name}" for name in stale])
+        self._stored.superseded_configs = {
+            name: since for name, since in superseded.items() if name not in stale
+        }
 
-        container.replan()
-        container.restart("dashboard")
+    def _validate_nginx(self, container):
+        """Check the config that has been pushed to the container with `nginx -t`."""
+        try:
+            container.exec(["nginx", "-t"]).wait_output()
+        except (APIError, ExecError) as error:
+            logger.warning("nginx config validation failed: %s", error)
+            return False
+        return True
 
 
 if __name__ == "__main__":
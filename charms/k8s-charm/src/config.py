@@ -1,11 +1,79 @@
+import functools
+import gzip
+import hashlib
+import json
 import logging
+import math
 import os
+import re
+import time
 from pathlib import Path
+from urllib.parse import urlsplit
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 logger = logging.getLogger(__name__)
 
+CONFIG_JS = "config.js"
+NGINX_CONF = "nginx.conf"
+NGINX_MAIN_CONF = "nginx.main.conf"
+INDEX_HTML = "index.html"
+
+# The template that each artifact is rendered from.
+TEMPLATES = {
+    CONFIG_JS: "config.js.j2",
+    NGINX_CONF: "nginx.conf.j2",
+    NGINX_MAIN_CONF: "nginx.main.conf.j2",
+    INDEX_HTML: "index.charm.html",
+}
+# The controller's CA certificate, which nginx verifies the controller against.
+CONTROLLER_CA = "controller-ca.pem"
+CONTROLLER_CA_PATH = "/etc/nginx/juju-controller-ca.pem"
+# Every artifact that can be generated.
+ARTIFACTS = (*TEMPLATES, CONTROLLER_CA)
+
+# Static assets with these suffixes are compressed ahead of time.
+COMPRESSIBLE_SUFFIXES = (".css", ".html", ".js", ".json", ".map", ".svg", ".txt")
+# Smaller files are not worth compressing.
+MIN_COMPRESSIBLE_SIZE = 1024
+COMPRESSED_MANIFEST = ".compressed.json"
+# The config script in index.html, whether or not it has already been hashed.
+CONFIG_SCRIPT = re.compile(
+    r"""(<script\s+src=["'][^"']*?)config(?:\.[0-9a-f]{12})?\.js(["'])"""
+)
+# The whole config script tag, which is replaced when the config is inlined.
+CONFIG_SCRIPT_TAG = re.compile(
+    r"""<script\s+src=["'][^"']*?config(?:\.[0-9a-f]{12})?\.js["']\s*>\s*</script>"""
+)
+HASHED_CONFIG_JS = re.compile(r"^config\.[0-9a-f]{12}\.js$")
+# How long a previous version of config.js is kept after index.html stops referring to
+# it, on top of how long nginx may serve the previous index.html from its cache, so that
+# a browser that has just loaded the previous index.html can still load its config.
+CONFIG_RETENTION = 300
+# Static files that are served from the root of the dashboard rather than from /assets.
+ROOT_STATIC_FILES = ("favicon.ico", "manifest.json", "app-icon.png")
+# The manifest that Vite writes for the build, relative to the build's root.
+VITE_MANIFEST = ".vite/manifest.json"
+# Controller units that take longer than this multiple of the nearest unit's latency,
+# or at least this many seconds longer, to connect to are used as backups.
+LATENCY_TOLERANCE = 3
+MIN_LATENCY_SPREAD = 0.02
+# The cgroup v2 files that limit the CPU and memory available to nginx.
+CGROUP_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_MEMORY_MAX = "/sys/fs/cgroup/memory.max"
+# The CPUs that nginx can be scheduled on.
+CGROUP_CPUSET = "/sys/fs/cgroup/cpuset.cpus.effective"
+# Each worker accepts up to this many connections, if there is enough memory for them.
+DEFAULT_WORKER_CONNECTIONS = 4096
+MIN_WORKER_CONNECTIONS = 512
+# Roughly the memory used by a proxied websocket, including its buffers.
+MEMORY_PER_CONNECTION = 64 * 1024
+
 
 def to_bool(boolean_variable) -> bool:
     if type(boolean_variable) is str:
@@ -13,19 +81,306 @@ def to_bool(boolean_variable) -> bool:
     return boolean_variable
 
 
+def template_digest(config_dir: str, template: str) -> str:
+    """Return a digest of a template used to generate the configs."""
+    return hashlib.sha256((Path(config_dir) / template).read_bytes()).hexdigest()
+
+
+def hashed_config_name(content: str) -> str:
+    """Return a filename for config.js that changes whenever its content does."""
+    return f"config.{hashlib.sha256(content.encode()).hexdigest()[:12]}.js"
+
+
+def stale_config_names(superseded: dict, now: float, cache_valid: int = 0) -> list:
+    """Return the names of previous versions of the hashed config.js that can be removed.
+
+    A version is superseded when index.html stops referring to it, including when the
+    config is inlined in index.html instead. It is kept for `CONFIG_RETENTION` seconds
+    longer than nginx may cache index.html for after that.
+
+    Args:
+        superseded: when each version that index.html no longer refers to was
+            superseded, by its name.
+        now: the current time.
+        cache_valid: how many seconds nginx may serve a cached index.html for.
+    """
+    retention = CONFIG_RETENTION + cache_valid
+    return sorted(
+        name
+        for name, since in superseded.items()
+        if HASHED_CONFIG_JS.match(name) and now - since >= retention
+    )
+
+
+def preload_assets(manifest_dir: str, entry: str) -> dict:
+    """Return the modules and stylesheets that a page in the Vite build manifest needs.
+
+    These are the page's own module and the chunks in its static import closure, along
+    with their CSS, which the browser would otherwise only discover one import at a
+    time. Nothing is returned if the build has no manifest.
+    """
+    try:
+        manifest = json.loads((Path(manifest_dir) / VITE_MANIFEST).read_text())
+    except (OSError, ValueError):
+        return {"modules": [], "styles": []}
+    modules = []
+    styles = []
+    pending = [entry]
+    seen = set()
+    while pending:
+        key = pending.pop(0)
+        if key in seen or key not in manifest:
+            continue
+        seen.add(key)
+        chunk = manifest[key]
+        modules.append(chunk["file"])
+        styles.extend(css for css in chunk.get("css", []) if css not in styles)
+        pending.extend(chunk.get("imports", []))
+    return {"modules": modules, "styles": styles}
+
+
+def preload_link(preloads: dict, base_app_url: str) -> str:
+    """Return a Link header that preloads the modules and stylesheets."""
+    base_app_url = base_app_url.rstrip("/")
+    links = [
+        f"<{base_app_url}/{module}>; rel=modulepreload; crossorigin"
+        for module in preloads["modules"]
+    ] + [
+        f"<{base_app_url}/{style}>; rel=preload; as=style"
+        for style in preloads["styles"]
+    ]
+    return ", ".join(links)
+
+
+@functools.lru_cache(maxsize=None)
+def environment(config_dir: str) -> Environment:
+    """Return the template environment, which is shared for the life of the process.
+
+    Compiled templates are also persisted to a bytecode cache that is keyed by the
+    checksum of each template, so that later hooks and container starts don't need to
+    parse and compile the templates again.
+    """
+    bytecode_cache = None
+    cache_dir = Path(config_dir) / "__pycache__"
+    try:
+        cache_dir.mkdir(exist_ok=True)
+        if os.access(cache_dir, os.W_OK):
+            bytecode_cache = FileSystemBytecodeCache(str(cache_dir))
+    except OSError as error:
+        logger.debug("Templates will not be cached: %s", error)
+    env = Environment(
+        loader=FileSystemLoader(config_dir), bytecode_cache=bytecode_cache
+    )
+    env.filters["bool"] = to_bool
+    return env
+
+
+def upstream_server(controller_url: str) -> str:
+    """Return the address that nginx should proxy to for a controller URL."""
+    # Nginx proxies to the controller over https.
+    url = controller_url.replace("wss://", "https://")
+    if not url.startswith("https://"):
+        url = "https://{}".format(url)
+    netloc = urlsplit(url).netloc
+    return netloc if re.search(r":\d+$", netloc) else f"{netloc}:443"
+
+
+def rank_servers(servers: list, latencies: dict | None = None) -> list:
+    """Return each server along with whether it should only be used as a backup.
+
+    Servers that are much slower to connect to than the nearest server, or that could
+    not be reached, are only used when the nearer servers have failed. The nearer
+    servers are listed first.
+    """
+    latencies = latencies or {}
+    measured = [
+        latencies[server] for server in servers if latencies.get(server) is not None
+    ]
+    if not measured:
+        return [[server, False] for server in servers]
+    nearest = min(measured)
+    limit = max(nearest * LATENCY_TOLERANCE, nearest + MIN_LATENCY_SPREAD)
+    ranked = [
+        [server, latencies.get(server) is None or latencies[server] > limit]
+        for server in servers
+    ]
+    return sorted(ranked, key=lambda pair: pair[1])
+
+
+def cpuset_size(cpuset: str | None) -> int | None:
+    """Return the number of CPUs in a cgroup's cpuset, such as `0-3,6`.
+
+    None is returned if the cpuset is empty or unknown.
+    """
+    count = 0
+    for cpus in (cpuset or "").split(","):
+        first, _, last = cpus.strip().partition("-")
+        if first:
+            count += int(last or first) - int(first) + 1
+    return count or None
+
+
+def worker_settings(
+    cpu_max: str | None,
+    memory_max: str | None,
+    cpu_count: int | None,
+    processes: int = 0,
+    connections: int = 0,
+    rlimit_nofile: int = 0,
+) -> dict:
+    """Size the nginx workers for the cgroup that nginx runs in.
+
+    Args:
+        cpu_max: the content of the cgroup's `cpu.max` file, or None if it has none.
+        memory_max: the content of the cgroup's `memory.max` file, or None if it has
+            none.
+        cpu_count: the number of CPUs that nginx can be scheduled on, or None if it
+            isn't known. If there is no CPU quota either, nginx starts a worker for
+            each CPU that it finds itself.
+        processes, connections, rlimit_nofile: values that override those derived from
+            the cgroup, unless they are 0.
+    """
+    if not processes:
+        limits = [cpu_count] if cpu_count else []
+        quota, _, period = (cpu_max or "max").partition(" ")
+        if quota != "max":
+            limits.append(math.ceil(int(quota) / int(period or 100000)))
+        processes = max(1, min(limits)) if limits else "auto"
+    if not connections:
+        connections = DEFAULT_WORKER_CONNECTIONS
+        if memory_max and memory_max.strip() != "max":
+            # The memory can't be divided between the workers when their number isn't
+            # known.
+            workers = processes if isinstance(processes, int) else 1
+            budget = int(memory_max) // MEMORY_PER_CONNECTION // workers
+            connections = max(MIN_WORKER_CONNECTIONS, min(connections, budget))
+    if not rlimit_nofile:
+        # A proxied websocket needs a file for the browser and one for the controller.
+        rlimit_nofile = connections * 2
+    return {
+        "processes": processes,
+        "connections": connections,
+        "rlimit_nofile": rlimit_nofile,
+    }
+
+
+def read_file(path: str) -> str | None:
+    """Return the content of a file, or None if it doesn't exist."""
+    try:
+        return Path(path).read_text()
+    except OSError:
+        return None
+
+
+def precompile(config_dir: str):
+    """Compile the templates into the bytecode cache, e.g. when building an image."""
+    env = environment(config_dir)
+    for template in TEMPLATES.values():
+        env.get_template(template)
+
+
+def _write_atomic(path: Path, content: bytes):
+    """Write a file so that nginx never serves a partially written copy."""
+    temp_path = path.with_name(f".{path.name}.tmp")
+    temp_path.write_bytes(content)
+    temp_path.replace(path)
+
+
+def compress_assets(
+    dashboard_root: str, static_gzip_level: int, static_brotli_level: int = 0
+):
+    """Write compressed copies of the static assets for nginx to serve directly.
+
+    A `.gz` file (and a `.br` file if brotli is available) is written next to each
+    asset. The levels used for each asset are recorded in a manifest, keyed by the
+    asset's content hash, so that unchanged assets are not compressed again. A level of
+    0 removes the compressed copies.
+    """
+    root = Path(dashboard_root)
+    manifest_path = root / COMPRESSED_MANIFEST
+    try:
+        manifest = json.loads(manifest_path.read_text())
+    except (OSError, ValueError):
+        manifest = {}
+    if brotli is None:
+        static_brotli_level = 0
+    encoders = {
+        ".gz": (
+            static_gzip_level,
+            lambda content: gzip.compress(
+                content, compresslevel=static_gzip_level, mtime=0
+            ),
+        ),
+        ".br": (
+            static_brotli_level,
+            lambda content: brotli.compress(content, quality=static_brotli_level),
+        ),
+    }
+    compressed = {}
+    for path in sorted((root / "assets").rglob("*")):
+        if not path.is_file() or path.suffix not in COMPRESSIBLE_SUFFIXES:
+            continue
+        content = path.read_bytes()
+        if len(content) < MIN_COMPRESSIBLE_SIZE:
+            continue
+        asset = str(path.relative_to(root))
+        entry = {
+            "digest": hashlib.sha256(content).hexdigest(),
+            "gzip": static_gzip_level,
+            "brotli": static_brotli_level,
+        }
+        for suffix, (level, compress) in encoders.items():
+            compressed_path = path.with_name(path.name + suffix)
+            if not level:
+                compressed_path.unlink(missing_ok=True)
+            elif manifest.get(asset) != entry or not compressed_path.exists():
+                _write_atomic(compressed_path, compress(content))
+        compressed[asset] = entry
+    if compressed != manifest:
+        logger.info("Compressed static assets in %s.", dashboard_root)
+        _write_atomic(manifest_path, json.dumps(compressed).encode())
+
+
 class Config:
     def __init__(
         self,
         config_dir: str,
-        controller_url: str,
+        controller_url: str | None,
         identity_provider_url: str | None,
         is_juju: bool,
         dashboard_root: str,
         analytics_enabled: bool,
         port: int,
         base_app_url: str,
+        strip_prefix: bool = False,
         config_file_name: str | None = None,
         has_external_controller_url=False,
+        controller_urls: list | None = None,
+        controller_latencies: dict | None = None,
+        proxy_connect_timeout: int = 5,
+        proxy_read_timeout: int = 3600,
+        proxy_send_timeout: int = 3600,
+        proxy_buffering: bool = False,
+        proxy_tcp_nodelay: bool = True,
+        proxy_socket_keepalive: bool = True,
+        controller_ca_cert: str | None = None,
+        workers: dict | None = None,
+        multi_accept: bool = True,
+        reuseport: bool = True,
+        sendfile: bool = True,
+        tcp_nopush: bool = True,
+        keepalive_timeout: int = 75,
+        keepalive_requests: int = 1000,
+        open_file_cache_max: int = 1000,
+        open_file_cache_valid: int = 30,
+        open_file_cache_min_uses: int = 2,
+        aio_threads: bool = False,
+        health_check_path: str = "/healthz",
+        reload_drain_timeout: int = 0,
+        compression_level: int = 5,
+        static_gzip_level: int = 9,
+        static_brotli_level: int = 0,
+        inline_config: bool = False,
     ):
         self._config_dir = config_dir
         self._config_file_name = config_file_name
@@ -36,64 +391,286 @@ class Config:
         self._analytics_enabled = analytics_enabled
         self._port = port
         self._has_external_controller_url = has_external_controller_url
+        self._proxy = {
+            "connect_timeout": proxy_connect_timeout,
+            "read_timeout": proxy_read_timeout,
+            "send_timeout": proxy_send_timeout,
+            "buffering": proxy_buffering,
+            "tcp_nodelay": proxy_tcp_nodelay,
+            "socket_keepalive": proxy_socket_keepalive,
+        }
+        self._controller_ca_cert = controller_ca_cert
+        self._reuseport = reuseport
+        self._health_check_path = health_check_path
+        self._static_files = {
+            "open_file_cache_max": open_file_cache_max,
+            "open_file_cache_valid": open_file_cache_valid,
+            "open_file_cache_min_uses": open_file_cache_min_uses,
+            "aio_threads": aio_threads,
+        }
+        workers = workers or worker_settings(None, None, os.cpu_count() or 1)
+        self._main = {
+            "worker_processes": workers["processes"],
+            "worker_connections": workers["connections"],
+            "worker_rlimit_nofile": workers["rlimit_nofile"],
+            "multi_accept": multi_accept,
+            "sendfile": sendfile,
+            "tcp_nopush": tcp_nopush,
+            "keepalive_timeout": keepalive_timeout,
+            "keepalive_requests": keepalive_requests,
+            "reload_drain_timeout": reload_drain_timeout,
+        }
+        # Every unit of an HA controller that nginx can proxy to, nearest first. There
+        # are none until the controller has provided its URL.
+        controller_urls = controller_urls or (
+            [controller_url] if controller_url else []
+        )
+        self._controller_servers = rank_servers(
+            [upstream_server(url) for url in controller_urls],
+            controller_latencies,
+        )
+        self._compression_level = compression_level
+        self._static_gzip_level = static_gzip_level
+        self._static_brotli_level = static_brotli_level
+        self._inline_config = inline_config
+        # The manifest is shipped alongside the index template that it was built with.
+        self._preloads = preload_assets(config_dir, TEMPLATES[INDEX_HTML])
         # Treat `/` as equivalent to an empty string, so templates don't end up with `//`.
         self._base_app_url = "" if base_app_url == "/" else base_app_url
+        # The path that nginx routes requests by, which doesn't include the base URL
+        # when the proxy in front of nginx strips it.
+        self._prefix = "" if strip_prefix else self._base_app_url.rstrip("/")
+        self._rendered = {}
+
+    def inputs(self) -> dict:
+        """Return the values that each generated artifact depends on.
+
+        An artifact only needs to be regenerated when its own inputs change, e.g. a
+        change to analytics only affects config.js, which nginx serves from disk. When
+        the config is inlined in index.html there is no config.js to generate.
+        """
+        config_js = {
+            "base_app_url": self._base_app_url,
+            "controller_url": self._controller_url,
+            "identity_provider_url": self._identity_provider_url,
+            "is_juju": self._is_juju,
+            "analytics_enabled": self._analytics_enabled,
+            "has_external_controller_url": self._has_external_controller_url,
+            "template": template_digest(self._config_dir, TEMPLATES[CONFIG_JS]),
+        }
+        inputs = {
+            CONFIG_JS: config_js,
+            NGINX_CONF: {
+                "base_app_url": self._base_app_url,
+                "prefix": self._prefix,
+                "controller_servers": self._controller_servers,
+                "proxy": self._proxy,
+                "verify_controller": bool(self._controller_ca_cert),
+                "reuseport": self._reuseport,
+                "static_files": self._static_files,
+                "health_check_path": self._health_check_path,
+                "dashboard_root": self._dashboard_root,
+                "port": self._port,
+                "is_juju": self._is_juju,
+                "compression_level": self._compression_level,
+                "gzip_static": bool(self._static_gzip_level),
+                "brotli_static": bool(self._static_brotli_level),
+                "preloads": self._preloads,
+                "template": template_digest(self._config_dir, TEMPLATES[NGINX_CONF]),
+            },
+            NGINX_MAIN_CONF: {
+                **self._main,
+                "template": template_digest(
+                    self._config_dir, TEMPLATES[NGINX_MAIN_CONF]
+                ),
+            },
+            INDEX_HTML: {
+                "base_app_url": self._base_app_url,
+                # index.html refers to config.js by the hash of its content, or
+                # includes its content when the config is inlined.
+                "config_js": config_js,
+                "inline_config": self._inline_config,
+                "preloads": self._preloads,
+                "template": template_digest(self._config_dir, TEMPLATES[INDEX_HTML]),
+            },
+        }
+        if self._inline_config:
+            del inputs[CONFIG_JS]
+        if self._controller_ca_cert:
+            inputs[CONTROLLER_CA] = {"cert": self._controller_ca_cert}
+        return inputs
+
+    def render(self, artifacts=None) -> dict:
+        """Render the requested artifacts, or every artifact that is needed if none are."""
+        artifacts = list(self.inputs()) if artifacts is None else artifacts
+        renderers = {
+            CONFIG_JS: self._render_config_js,
+            NGINX_CONF: self._render_nginx_conf,
+            NGINX_MAIN_CONF: self._render_nginx_main_conf,
+            CONTROLLER_CA: self._render_controller_ca,
+            INDEX_HTML: self._render_index_html,
+        }
+        for artifact in artifacts:
+            if artifact not in self._rendered:
+                template = None
+                if artifact in TEMPLATES:
+                    env = environment(self._config_dir)
+                    template = env.get_template(TEMPLATES[artifact])
+                self._rendered[artifact] = renderers[artifact](template)
+        return {artifact: self._rendered[artifact] for artifact in artifacts}
 
     def generate(self):
-        env = Environment(loader=FileSystemLoader(self._config_dir))
-        env.filters["bool"] = to_bool
-        config_template = env.get_template("config.js.j2")
+        rendered = self.render([CONFIG_JS, NGINX_CONF, INDEX_HTML])
+        return rendered[CONFIG_JS], rendered[NGINX_CONF], rendered[INDEX_HTML]
+
+    def config_js_name(self) -> str:
+        """Return the content-hashed filename that index.html loads config.js from."""
+        return hashed_config_name(self.render([CONFIG_JS])[CONFIG_JS])
+
+    def _render_config_js(self, template):
         controller_base_url = (
             self._base_app_url
             if self._is_juju and not self._has_external_controller_url
             else self._controller_url
         )
-        config = config_template.render(
+        return template.render(
             base_app_url=self._base_app_url,
-            controller_api_endpoint=f"{controller_base_url}/api",
+            # The app reports that it isn't configured until there is a controller.
+            controller_api_endpoint=(
+                f"{controller_base_url}/api" if self._controller_url else ""
+            ),
             identity_provider_url=self._identity_provider_url or "",
             is_juju=self._is_juju,
             analytics_enabled=self._analytics_enabled,
         )
-        nginx_template = env.get_template("nginx.conf.j2")
-        # Nginx proxy_pass expects the protocol to be https.
-        controller_url = self._controller_url.replace("wss://", "https://")
-        if not controller_url.startswith("https://"):
-            controller_url = "https://{}".format(controller_url)
-        nginx_config = nginx_template.render(
-            base_app_url=self._base_app_url,
-            controller_ws_api=controller_url,
+
+    def _render_nginx_main_conf(self, template):
+        return template.render(**self._main)
+
+    def _render_controller_ca(self, _):
+        return self._controller_ca_cert
+
+    def _render_nginx_conf(self, template):
+        return template.render(
+            prefix=self._prefix,
+            controller_servers=self._controller_servers,
+            proxy=self._proxy,
+            controller_ca=CONTROLLER_CA_PATH if self._controller_ca_cert else None,
+            reuseport=self._reuseport,
+            static_files=self._static_files,
+            health_check_path=self._health_check_path,
             dashboard_root=self._dashboard_root,
             port=self._port,
             is_juju=self._is_juju,
+            compression_level=self._compression_level,
+            gzip_static=bool(self._static_gzip_level),
+            brotli_static=bool(self._static_brotli_level),
+            root_static_files=ROOT_STATIC_FILES,
+            preload_link=preload_link(self._preloads, self._base_app_url),
         )
-        index_template = env.get_template("index.charm.html")
+
+    def _render_index_html(self, template):
         base_app_url = (
             self._base_app_url
             if self._base_app_url is None or self._base_app_url.endswith("/")
             else f"{self._base_app_url}/"
         )
-        index_html = index_template.render(
+        index_html = template.render(
             base_app_url=base_app_url,
         )
-        return config, nginx_config, index_html
+        index_html = self._add_preloads(index_html)
+        if self._inline_config:
+            # Include the config in the page so that it doesn't need to be requested
+            # before the app can start. `</` is escaped so that a value can't close the
+            # script element.
+            config_js = self.render([CONFIG_JS])[CONFIG_JS].replace("</", "<\\/")
+            return CONFIG_SCRIPT_TAG.sub(
+                lambda _: f"<script>\n{config_js}</script>", index_html
+            )
+        # Refer to config.js by its hashed name so that browsers can cache it forever.
+        return CONFIG_SCRIPT.sub(rf"\g<1>{self.config_js_name()}\g<2>", index_html)
 
-    def write(self, write_config_js=True, write_nginx=True, write_index=True):
-        dashboard_config, nginx_config, index_html = self.generate()
-        if write_config_js:
-            config_path = Path(self._dashboard_root) / (
-                self._config_file_name or "config.js"
+    def _add_preloads(self, index_html):
+        """Preload the modules and stylesheets that the page doesn't already refer to."""
+        links = [
+            f'<link rel="modulepreload" crossorigin href="{module}" />'
+            for module in self._preloads["modules"]
+            if module not in index_html
+        ] + [
+            f'<link rel="preload" as="style" href="{style}" />'
+            for style in self._preloads["styles"]
+            if style not in index_html
+        ]
+        if not links:
+            return index_html
+        return index_html.replace("</head>", "".join(links) + "</head>", 1)
+
+    def write(
+        self,
+        write_config_js=True,
+        write_nginx=True,
+        write_index=True,
+        write_controller_ca=True,
+        write_main_nginx=True,
+    ):
+        root = Path(self._dashboard_root)
+        paths = {}
+        # config.js isn't needed when it is inlined in the index.html that is written.
+        inline = write_index and self._inline_config
+        config_name = None
+        if write_config_js and not inline:
+            # The hashed name is only used when index.html is written to refer to it.
+            config_name = (
+                self.config_js_name()
+                if write_index
+                else self._config_file_name or "config.js"
             )
-            config_path.write_text(dashboard_config)
+            paths[CONFIG_JS] = root / config_name
         if write_index:
-            config_path = Path(self._dashboard_root) / "index.html"
-            config_path.write_text(index_html)
+            paths[INDEX_HTML] = root / "index.html"
         if write_nginx:
-            nginx_path = Path("/etc/nginx/sites-available/default")
-            nginx_path.write_text(nginx_config)
+            paths[NGINX_CONF] = Path("/etc/nginx/sites-available/default")
+        if write_main_nginx:
+            paths[NGINX_MAIN_CONF] = Path("/etc/nginx/nginx.conf")
+        if write_controller_ca and self._controller_ca_cert:
+            paths[CONTROLLER_CA] = Path(CONTROLLER_CA_PATH)
+        remove_stale = write_index and (write_config_js or inline)
+        # The versions that the previous index.html didn't refer to were superseded by
+        # the time that it was written, and the rest are superseded now.
+        previous_index, previous_written = "", None
+        if remove_stale and (root / "index.html").exists():
+            previous_index = (root / "index.html").read_text()
+            previous_written = (root / "index.html").stat().st_mtime
+        # The files are replaced rather than rewritten, so that nginx doesn't serve a
+        # partially written file, nor one whose size it cached before it changed.
+        for artifact, content in self.render(list(paths)).items():
+            _write_atomic(paths[artifact], content.encode())
+        if remove_stale:
+            now = time.time()
+            superseded = {
+                path.name: (
+                    previous_written
+                    if previous_written is not None and path.name not in previous_index
+                    else now
+                )
+                for path in root.glob("config.*.js")
+                if path.name != config_name
+            }
+            for name in stale_config_names(
+                superseded, now, self._static_files["open_file_cache_valid"]
+            ):
+                (root / name).unlink(missing_ok=True)
 
 
 if __name__ == "__main__":
+    compression_level = int(os.environ.get("DASHBOARD_COMPRESSION_LEVEL", 5))
+    static_gzip_level = int(os.environ.get("DASHBOARD_STATIC_GZIP_LEVEL", 9))
+    static_brotli_level = int(os.environ.get("DASHBOARD_STATIC_BROTLI_LEVEL", 11))
+    compress_assets(
+        os.environ.get("DASHBOARD_ROOT", "/srv"),
+        static_gzip_level=static_gzip_level,
+        static_brotli_level=static_brotli_level,
+    )
     controller_url = os.environ.get("DASHBOARD_CONTROLLER_URL")
     if controller_url is None:
         logger.debug(
@@ -115,9 +692,62 @@ if __name__ == "__main__":
             dashboard_root=os.environ.get("DASHBOARD_ROOT", "/srv"),
             port=int(os.environ.get("DASHBOARD_PORT", 8080)),
             base_app_url=os.environ.get("DASHBOARD_BASE_APP_URL", ""),
+            strip_prefix=to_bool(os.environ.get("DASHBOARD_STRIP_PREFIX", False)),
             has_external_controller_url=to_bool(
                 os.environ.get("HAS_EXTERNAL_CONTROLLER_URL", False)
             ),
+            controller_urls=os.environ.get("DASHBOARD_CONTROLLER_URLS", "").split(),
+            proxy_connect_timeout=int(
+                os.environ.get("DASHBOARD_PROXY_CONNECT_TIMEOUT", 5)
+            ),
+            proxy_read_timeout=int(
+                os.environ.get("DASHBOARD_PROXY_READ_TIMEOUT", 3600)
+            ),
+            proxy_send_timeout=int(
+                os.environ.get("DASHBOARD_PROXY_SEND_TIMEOUT", 3600)
+            ),
+            proxy_buffering=to_bool(os.environ.get("DASHBOARD_PROXY_BUFFERING", False)),
+            proxy_tcp_nodelay=to_bool(
+                os.environ.get("DASHBOARD_PROXY_TCP_NODELAY", True)
+            ),
+            proxy_socket_keepalive=to_bool(
+                os.environ.get("DASHBOARD_PROXY_SOCKET_KEEPALIVE", True)
+            ),
+            controller_ca_cert=os.environ.get("DASHBOARD_CONTROLLER_CA_CERT"),
+            workers=worker_settings(
+                read_file(CGROUP_CPU_MAX),
+                read_file(CGROUP_MEMORY_MAX),
+                len(os.sched_getaffinity(0)),
+                processes=int(os.environ.get("DASHBOARD_WORKER_PROCESSES", 0)),
+                connections=int(os.environ.get("DASHBOARD_WORKER_CONNECTIONS", 0)),
+                rlimit_nofile=int(os.environ.get("DASHBOARD_WORKER_RLIMIT_NOFILE", 0)),
+            ),
+            multi_accept=to_bool(os.environ.get("DASHBOARD_MULTI_ACCEPT", True)),
+            reuseport=to_bool(os.environ.get("DASHBOARD_REUSEPORT", True)),
+            sendfile=to_bool(os.environ.get("DASHBOARD_SENDFILE", True)),
+            tcp_nopush=to_bool(os.environ.get("DASHBOARD_TCP_NOPUSH", True)),
+            keepalive_timeout=int(os.environ.get("DASHBOARD_KEEPALIVE_TIMEOUT", 75)),
+            keepalive_requests=int(
+                os.environ.get("DASHBOARD_KEEPALIVE_REQUESTS", 1000)
+            ),
+            open_file_cache_max=int(
+                os.environ.get("DASHBOARD_OPEN_FILE_CACHE_MAX", 1000)
+            ),
+            open_file_cache_valid=int(
+                os.environ.get("DASHBOARD_OPEN_FILE_CACHE_VALID", 30)
+            ),
+            open_file_cache_min_uses=int(
+                os.environ.get("DASHBOARD_OPEN_FILE_CACHE_MIN_USES", 2)
+            ),
+            aio_threads=to_bool(os.environ.get("DASHBOARD_AIO_THREADS", False)),
+            health_check_path=os.environ.get("DASHBOARD_HEALTH_CHECK_PATH", "/healthz"),
+            reload_drain_timeout=int(
+                os.environ.get("DASHBOARD_RELOAD_DRAIN_TIMEOUT", 300)
+            ),
+            compression_level=compression_level,
+            static_gzip_level=static_gzip_level,
+            static_brotli_level=static_brotli_level,
+            inline_config=to_bool(os.environ.get("DASHBOARD_INLINE_CONFIG", False)),
         )
         config.write(
             write_config_js=to_bool(os.environ.get("WRITE_CONFIG_JS", True)),
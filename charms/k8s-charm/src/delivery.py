@@ -0,0 +1,63 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Deliver generated files to the workload container."""
+
+import hashlib
+import logging
+
+from ops.framework import Object, StoredState
+
+logger = logging.getLogger(__name__)
+
+
+class FileDelivery(Object):
+    """Push files to the workload container, skipping any that are already up to date.
+
+    A digest of each file is recorded in StoredState once it has been pushed, so a hook
+    that fails part way through only pushes the remaining files when it is retried.
+    Pebble writes each file to a temporary file and renames it into place, so nginx
+    never serves a partially written file.
+    """
+
+    _stored = StoredState()
+
+    def __init__(self, charm):
+        super().__init__(charm, "delivery")
+        self._stored.set_default(digests={})
+
+    def deliver(self, container, files: dict) -> list:
+        """Push the files whose contents differ from what was last delivered.
+
+        Args:
+            container: the workload container to push the files to.
+            files: a mapping of paths in the container to their contents.
+
+        Returns the paths of the files that were pushed.
+        """
+        pending = {}
+        for path, content in files.items():
+            digest = hashlib.sha256(content.encode()).hexdigest()
+            if self._stored.digests.get(path) == digest:
+                logger.debug("Not pushing %s as it is unchanged.", path)
+            else:
+                pending[path] = (content, digest)
+        for path, (content, digest) in pending.items():
+            container.push(path, content, make_dirs=True)
+            self._stored.digests = {**self._stored.digests, path: digest}
+        if pending:
+            logger.info("Pushed %s.", ", ".join(pending))
+        return list(pending)
+
+    def remove(self, container, paths: list):
+        """Remove files from the container, so that they are pushed again if needed."""
+        for path in paths:
+            container.remove_path(path)
+            digests = dict(self._stored.digests)
+            digests.pop(path, None)
+            self._stored.digests = digests
+        if paths:
+            logger.info("Removed %s.", ", ".join(paths))
+
+    def invalidate(self):
+        """Forget what has been delivered, e.g. when the container has been replaced."""
+        self._stored.digests = {}
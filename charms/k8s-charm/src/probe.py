@@ -0,0 +1,96 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Measure how long it takes to connect to each controller unit."""
+
+import logging
+import socket
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ops.framework import Object, StoredState
+
+logger = logging.getLogger(__name__)
+
+# How long a measurement is reused for before the unit is probed again.
+PROBE_TTL = 300
+# How long to wait for a unit to accept a connection and complete the TLS handshake.
+PROBE_TIMEOUT = 1.0
+# How many units are probed at once.
+PROBE_CONCURRENCY = 4
+
+
+def measure_latency(server: str, timeout: float = PROBE_TIMEOUT) -> float | None:
+    """Return the seconds taken to open a TLS connection to a `host:port` address.
+
+    Only the time to connect is of interest, so the certificate is not verified and no
+    data is sent. Returns None if the connection could not be made.
+    """
+    host, _, port = server.rpartition(":")
+    host = host.strip("[]")
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    start = time.monotonic()
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout) as sock:
+            with context.wrap_socket(sock):
+                pass
+    except (OSError, ValueError) as error:
+        logger.debug("Could not connect to %s: %s", server, error)
+        return None
+    return time.monotonic() - start
+
+
+class LatencyProbe(Object):
+    """Measure the connection latency to each unit of an HA controller.
+
+    The measurements are persisted in StoredState along with when they were made, so
+    that units are only probed again once the measurement has expired.
+    """
+
+    _stored = StoredState()
+
+    def __init__(self, charm):
+        super().__init__(charm, "latency-probe")
+        self._stored.set_default(results={})
+
+    def expired(self, servers: list) -> bool:
+        """Return whether any of the servers is due to be probed again."""
+        if len(servers) < 2:
+            return False
+        now = time.time()
+        results = self._stored.results
+        return any(
+            server not in results or now - results[server]["measured"] >= PROBE_TTL
+            for server in servers
+        )
+
+    def measure(self, servers: list) -> dict:
+        """Return the latency to each server, probing any without a current measurement.
+
+        There is nothing to choose between when there is a single server, so it isn't
+        probed.
+        """
+        if len(servers) < 2:
+            return {}
+        now = time.time()
+        results = {
+            server: result
+            for server, result in self._stored.results.items()
+            if server in servers and now - result["measured"] < PROBE_TTL
+        }
+        expired = [server for server in servers if server not in results]
+        if expired:
+            with ThreadPoolExecutor(max_workers=PROBE_CONCURRENCY) as executor:
+                latencies = executor.map(measure_latency, expired)
+                for server, latency in zip(expired, latencies):
+                    results[server] = {"latency": latency, "measured": now}
+            logger.info(
+                "Measured controller latency: %s.",
+                ", ".join(
+                    f"{server}={results[server]['latency']}" for server in expired
+                ),
+            )
+        self._stored.results = results
+        return {server: results[server]["latency"] for server in servers}
@@ -3,24 +3,58 @@
 #
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
+import json
+import re
+import shutil
+import tempfile
+import time
 import unittest
+from pathlib import Path
 from unittest.mock import PropertyMock, patch
 
-from ops.model import ActiveStatus, BlockedStatus
-from ops.testing import Harness
+from charms.juju_dashboard.v0.juju_dashboard import update_databag
+from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus
+from ops.pebble import CheckInfo, CheckLevel, CheckStatus, Plan
+from ops.testing import ExecResult, Harness
 
 from charm import JujuDashboardKubernetesCharm
+from config import CONFIG_RETENTION, cpuset_size, preload_link, stale_config_names
+
+SRC_DIR = Path(__file__).parent.parent / "src"
+
+
+def read_config(container):
+    """Return the content of the config.js that index.html refers to."""
+    with container.pull("/srv/index.html") as f:
+        (name,) = re.findall(r'src="(config\.[0-9a-f]+\.js)"', f.read())
+    with container.pull(f"/srv/{name}") as f:
+        return f.read()
 
 
 class TestCharm(unittest.TestCase):
     def setUp(self):
+        # The charm keeps the files that it fetches from the workload next to its
+        # templates, so the templates are copied to a temporary directory that the tests
+        # can write to instead of src.
+        config_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(config_dir.cleanup)
+        for template in SRC_DIR.glob("*.j2"):
+            shutil.copy(template, config_dir.name)
+        patcher = patch("charm.CONFIG_DIR", Path(config_dir.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
         self.harness = Harness(JujuDashboardKubernetesCharm)
         self.addCleanup(self.harness.cleanup)
         self.harness.begin_with_initial_hooks()
         self.harness.set_can_connect("dashboard", True)
+        self.nginx_commands = []
+        self.harness.handle_exec("dashboard", ["nginx"], handler=self._handle_nginx)
         self.container = self.harness.model.unit.get_container("dashboard")
         self.container.make_dir("/srv")
-        self.container.push("/srv/index.charm.html", '<base href="{{base_app_url}}" />')
+        self.container.push(
+            "/srv/index.charm.html",
+            '<base href="{{base_app_url}}" /><script src="config.js"></script>',
+        )
         self.container.make_dir("/etc/nginx/sites-available/", make_parents=True)
         self.rel_id = self.harness.add_relation("controller", "controller")
         self.harness.add_relation_unit(self.rel_id, "controller/0")
@@ -34,6 +68,13 @@ class TestCharm(unittest.TestCase):
             },
         )
 
+    def _read_config(self):
+        return read_config(self.container)
+
+    def _handle_nginx(self, args):
+        self.nginx_commands.append(args.command)
+        return ExecResult(exit_code=0)
+
     def test_on_controller_relation_changed(self):
         self.harness.update_relation_data(
             self.rel_id,
@@ -44,11 +85,101 @@ class TestCharm(unittest.TestCase):
         )
         with self.container.pull("/etc/nginx/sites-available/default") as f:
             nginx_config = f.read()
-        self.assertTrue("https://10.10.10.1:107070" in nginx_config)
-        with self.container.pull("/srv/config.js") as f:
-            config = f.read()
+        self.assertIn("server 10.10.10.1:107070 max_fails=3", nginx_config)
+        self.assertIn("proxy_pass https://controller;", nginx_config)
+        config = self._read_config()
         self.assertTrue("isJuju: true" in config)
 
+    def test_cache_headers(self):
+        with self.container.pull("/etc/nginx/sites-available/default") as f:
+            nginx_config = f.read()
+        self.assertIn(
+            'add_header Cache-Control "public, max-age=31536000, immutable";',
+            nginx_config,
+        )
+        self.assertIn("location = /favicon.ico {", nginx_config)
+        self.assertIn("try_files /favicon.ico =404;", nginx_config)
+
+    def test_health_check(self):
+        with self.container.pull("/etc/nginx/sites-available/default") as f:
+            nginx_config = f.read()
+        self.assertIn("location = /healthz {", nginx_config)
+        self.assertEqual(
+            self.harness.charm.ingress.healthcheck_params,
+            {"path": "/healthz", "interval": "10s", "timeout": "5s"},
+        )
+        self.harness.update_config({"health-check-path": ""})
+        with self.container.pull("/etc/nginx/sites-available/default") as f:
+            nginx_config = f.read()
+        self.assertNotIn("healthz", nginx_config)
+        self.assertIsNone(self.harness.charm.ingress.healthcheck_params)
+
+    def test_pebble_checks(self):
+        plan = self.harness.get_container_pebble_plan("dashboard").to_dict()
+        self.assertEqual(
+            plan["checks"]["nginx-ready"],
+            {
+                "override": "replace",
+                "level": "ready",
+                "startup": "enabled",
+                "period": "10s",
+                "timeout": "5s",
+                "threshold": 3,
+                "http": {"url": "http://localhost:8080/healthz"},
+            },
+        )
+        service = plan["services"]["dashboard"]
+        self.assertEqual(service["on-check-failure"], {"nginx-ready": "restart"})
+        self.assertEqual(service["backoff-delay"], "0.5s")
+        self.assertEqual(service["backoff-limit"], "30s")
+
+    def test_normalised_plan_does_not_restart_nginx(self):
+        # Pebble reports durations in its own format, so the plan that it returns never
+        # matches the layer exactly, e.g. a backoff delay of 0.5s is reported as 500ms.
+        plan = self.harness.get_container_pebble_plan("dashboard").to_dict()
+        plan["services"]["dashboard"]["backoff-delay"] = "500ms"
+        with patch("ops.model.Container.get_plan", return_value=Plan(plan)), patch(
+            "ops.model.Container.restart"
+        ) as mock_restart, patch("ops.model.Container.send_signal") as mock_send_signal:
+            self.harness.update_config({"proxy-read-timeout": 600})
+        mock_restart.assert_not_called()
+        mock_send_signal.assert_called_once_with("SIGHUP", "dashboard")
+
+    def test_layer_changed_restarts_nginx(self):
+        with patch("ops.model.Container.restart") as mock_restart:
+            self.harness.update_config({"restart-backoff-delay": 2.0})
+        mock_restart.assert_called_once_with("dashboard")
+        plan = self.harness.get_container_pebble_plan("dashboard").to_dict()
+        self.assertEqual(plan["services"]["dashboard"]["backoff-delay"], "2.0s")
+
+    def test_pebble_checks_disabled(self):
+        self.harness.update_config({"health-check-path": ""})
+        plan = self.harness.get_container_pebble_plan("dashboard").to_dict()
+        self.assertNotIn("on-check-failure", plan["services"]["dashboard"])
+        # The check that was started before is stopped and kept from starting again.
+        self.assertEqual(plan["checks"]["nginx-ready"]["startup"], "disabled")
+        self.assertEqual(
+            self.container.get_check("nginx-ready").status, CheckStatus.INACTIVE
+        )
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    def test_check_failed_status(self):
+        check = CheckInfo("nginx-ready", CheckLevel.READY, CheckStatus.DOWN)
+        with patch("ops.model.Container.get_checks", return_value={check.name: check}):
+            self.harness.charm.on["dashboard"].pebble_check_failed.emit(
+                self.container, "nginx-ready"
+            )
+            self.assertEqual(
+                self.harness.model.unit.status,
+                MaintenanceStatus("Waiting for nginx to respond to health checks."),
+            )
+            check.status = CheckStatus.UP
+            self.harness.charm.on["dashboard"].pebble_check_recovered.emit(
+                self.container, "nginx-ready"
+            )
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
     def test_relation_departed(self):
         self.harness.model.unit.status = ActiveStatus()
         self.harness.remove_relation(self.rel_id)
@@ -56,6 +187,69 @@ class TestCharm(unittest.TestCase):
             self.harness.model.unit.status,
             BlockedStatus("Missing controller integration"),
         )
+        # The dashboard is still served, but nothing is proxied.
+        with self.container.pull("/etc/nginx/sites-available/default") as f:
+            self.assertNotIn("proxy_pass", f.read())
+
+    def test_serves_without_controller(self):
+        harness = Harness(JujuDashboardKubernetesCharm)
+        self.addCleanup(harness.cleanup)
+        harness.set_can_connect("dashboard", True)
+        harness.handle_exec("dashboard", ["nginx"], result=0)
+        container = harness.model.unit.get_container("dashboard")
+        container.push(
+            "/srv/index.charm.html", '<script src="config.js"></script>', make_dirs=True
+        )
+        container.make_dir("/etc/nginx/sites-available/", make_parents=True)
+        harness.begin_with_initial_hooks()
+        self.assertTrue(container.get_service("dashboard").is_running())
+        self.assertIn('controllerAPIEndpoint: "",', read_config(container))
+        nginx_config = container.pull("/etc/nginx/sites-available/default").read()
+        self.assertNotIn("proxy_pass", nginx_config)
+        self.assertEqual(
+            harness.model.unit.status,
+            BlockedStatus("Missing controller integration"),
+        )
+        # The workload is updated in place once the controller provides its URL.
+        rel_id = harness.add_relation("controller", "controller")
+        harness.add_relation_unit(rel_id, "controller/0")
+        harness.update_relation_data(
+            rel_id, "controller", {"controller-url": "wss://10.10.10.1:17070"}
+        )
+        self.assertIn('controllerAPIEndpoint: "/api",', read_config(container))
+        nginx_config = container.pull("/etc/nginx/sites-available/default").read()
+        self.assertIn("server 10.10.10.1:17070 max_fails=3", nginx_config)
+        self.assertEqual(harness.model.unit.status, ActiveStatus())
+
+    def test_dashboard_relation_port(self):
+        self.harness.set_leader(True)
+        rel_id = self.harness.add_relation("dashboard", "proxy")
+        self.harness.add_relation_unit(rel_id, "proxy/0")
+        self.harness.update_relation_data(rel_id, "proxy/0", {"ready": "true"})
+        relation = self.harness.model.get_relation("dashboard", rel_id)
+        self.assertEqual(relation.data[self.harness.charm.app]["port"], "8080")
+        self.assertEqual(relation.data[self.harness.charm.unit]["port"], "8080")
+        # The port isn't written again while it is unchanged.
+        with patch("ops.model.RelationDataContent.__setitem__") as mock_setitem:
+            self.harness.charm.on["dashboard"].relation_changed.emit(
+                relation, relation.app
+            )
+        mock_setitem.assert_not_called()
+
+    def test_ingress_requirements_unchanged(self):
+        harness = Harness(JujuDashboardKubernetesCharm)
+        self.addCleanup(harness.cleanup)
+        harness.set_model_name("dashboard")
+        harness.add_network("10.10.10.10")
+        harness.set_leader(True)
+        harness.begin()
+        rel_id = harness.add_relation("ingress", "traefik")
+        harness.add_relation_unit(rel_id, "traefik/0")
+        relation = harness.model.get_relation("ingress", rel_id)
+        self.assertEqual(relation.data[harness.charm.app]["port"], "8080")
+        with patch("ops.model.RelationDataContent.__setitem__") as mock_setitem:
+            harness.charm.ingress.provide_ingress_requirements(port=8080)
+        mock_setitem.assert_not_called()
 
     @patch(
         "charms.traefik_k8s.v2.ingress.IngressPerAppRequirer.url",
@@ -66,8 +260,7 @@ class TestCharm(unittest.TestCase):
     )
     def test_config_changed(self, mock_provide_ingress_requirements, mock_url):
         mock_url.return_value = None
-        with self.container.pull("/srv/config.js") as f:
-            config = f.read()
+        config = self._read_config()
         self.assertTrue("analyticsEnabled: true" in config)
         with self.container.pull("/etc/nginx/sites-available/default") as f:
             nginx_config = f.read()
@@ -77,8 +270,7 @@ class TestCharm(unittest.TestCase):
         self.assertTrue('<base href="/" />' in index_html)
         mock_url.return_value = "/dashboard"
         self.harness.update_config({"analytics-enabled": False, "port": 123})
-        with self.container.pull("/srv/config.js") as f:
-            config = f.read()
+        config = self._read_config()
         self.assertTrue("analyticsEnabled: false" in config)
         with self.container.pull("/etc/nginx/sites-available/default") as f:
             nginx_config = f.read()
@@ -101,22 +293,510 @@ class TestCharm(unittest.TestCase):
         self.harness.disable_hooks()
         self.harness.update_config({"analytics-enabled": False})
         self.harness.enable_hooks()
-        with self.container.pull("/srv/config.js") as f:
-            config = f.read()
+        config = self._read_config()
         self.assertTrue("analyticsEnabled: true" in config)
         self.harness.charm.on.update_status.emit()
-        with self.container.pull("/srv/config.js") as f:
-            config = f.read()
+        config = self._read_config()
         self.assertTrue("analyticsEnabled: false" in config)
 
     def test_upgrade_charm(self):
         self.harness.disable_hooks()
         self.harness.update_config({"analytics-enabled": False})
         self.harness.enable_hooks()
-        with self.container.pull("/srv/config.js") as f:
-            config = f.read()
+        config = self._read_config()
         self.assertTrue("analyticsEnabled: true" in config)
         self.harness.charm.on.upgrade_charm.emit()
-        with self.container.pull("/srv/config.js") as f:
-            config = f.read()
+        config = self._read_config()
         self.assertTrue("analyticsEnabled: false" in config)
+
+    def test_update_status_unchanged(self):
+        with patch.object(JujuDashboardKubernetesCharm, "_configure") as mock_configure:
+            self.harness.charm.on.update_status.emit()
+        mock_configure.assert_not_called()
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    def test_waits_for_pebble_ready(self):
+        self.harness.set_can_connect("dashboard", False)
+        with patch("ops.framework.EventBase.defer") as mock_defer:
+            self.harness.update_config({"analytics-enabled": False})
+            self.harness.charm.on.update_status.emit()
+        mock_defer.assert_not_called()
+        self.assertEqual(
+            self.harness.model.unit.status, MaintenanceStatus("Waiting for container.")
+        )
+        self.harness.container_pebble_ready("dashboard")
+        config = self._read_config()
+        self.assertIn("analyticsEnabled: false", config)
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    def test_reconcile_stats_action(self):
+        before = self.harness.run_action("reconcile-stats").results
+        self.harness.charm.on.update_status.emit()
+        self.harness.set_can_connect("dashboard", False)
+        self.harness.update_config({"analytics-enabled": False})
+        after = self.harness.run_action("reconcile-stats").results
+        self.assertEqual(after["avoided"], before["avoided"] + 2)
+        self.assertEqual(after["state-unchanged"], before.get("state-unchanged", 0) + 1)
+        self.assertEqual(
+            after["container-unavailable"], before.get("container-unavailable", 0) + 1
+        )
+
+    def test_events_coalesced(self):
+        self.harness.disable_hooks()
+        self.harness.update_config({"analytics-enabled": False})
+        self.harness.enable_hooks()
+        relation = self.harness.model.get_relation("controller", self.rel_id)
+        with patch.object(
+            JujuDashboardKubernetesCharm, "_configure", return_value=None
+        ) as mock_configure:
+            self.harness.charm.on.config_changed.emit()
+            self.harness.charm.on["controller"].relation_changed.emit(
+                relation, relation.app
+            )
+            self.harness.charm.on.update_status.emit()
+        mock_configure.assert_called_once()
+
+    @patch("probe.measure_latency", return_value=0.01)
+    def test_controller_units_coalesced(self, _):
+        relation = self.harness.model.get_relation("controller", self.rel_id)
+        with patch.object(
+            JujuDashboardKubernetesCharm, "_configure", return_value=None
+        ) as mock_configure:
+            for unit in ("controller/1", "controller/2"):
+                self.harness.add_relation_unit(self.rel_id, unit)
+                self.harness.update_relation_data(
+                    self.rel_id, unit, {"ingress-address": "10.10.10.2"}
+                )
+                self.harness.charm.on["controller"].relation_changed.emit(
+                    relation, relation.app
+                )
+        # The state only changes when the first unit provides its address.
+        mock_configure.assert_called_once()
+
+    def test_upgrade_charm_unchanged(self):
+        with patch.object(JujuDashboardKubernetesCharm, "_configure") as mock_configure:
+            self.harness.charm.on.upgrade_charm.emit()
+        mock_configure.assert_called_once()
+
+    def test_config_changed_reloads_nginx(self):
+        with patch("ops.model.Container.restart") as mock_restart, patch(
+            "ops.model.Container.send_signal"
+        ) as mock_send_signal:
+            self.harness.update_config({"port": 123})
+        self.assertEqual(self.nginx_commands, [["nginx", "-t"]])
+        mock_send_signal.assert_called_once_with("SIGHUP", "dashboard")
+        mock_restart.assert_not_called()
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    def test_config_changed_invalid_nginx_config(self):
+        commands = []
+
+        def handle_nginx(args):
+            commands.append(args.command)
+            return ExecResult(exit_code=1)
+
+        self.harness.handle_exec("dashboard", ["nginx"], handler=handle_nginx)
+        with patch("ops.model.Container.restart") as mock_restart, patch(
+            "ops.model.Container.send_signal"
+        ) as mock_send_signal:
+            self.harness.update_config({"port": 123})
+            # The config is validated again on the next attempt, as it wasn't applied.
+            self.harness.charm.on.update_status.emit()
+        mock_send_signal.assert_not_called()
+        mock_restart.assert_not_called()
+        self.assertEqual(commands, [["nginx", "-t"], ["nginx", "-t"]])
+        self.assertEqual(
+            self.harness.model.unit.status, BlockedStatus("Invalid nginx config")
+        )
+
+    def test_config_js_changed_does_not_reload_nginx(self):
+        self.nginx_commands.clear()
+        with patch("ops.model.Container.restart") as mock_restart, patch(
+            "ops.model.Container.send_signal"
+        ) as mock_send_signal, patch(
+            "ops.model.Container.push", autospec=True
+        ) as mock_push:
+            self.harness.update_config({"analytics-enabled": False})
+        pushed = [call.args[1] for call in mock_push.call_args_list]
+        self.assertRegex(pushed[0], r"^/srv/config\.[0-9a-f]{12}\.js$")
+        self.assertEqual(pushed[1:], ["/srv/index.html"])
+        self.assertIn("analyticsEnabled: false", mock_push.call_args_list[0].args[2])
+        mock_send_signal.assert_not_called()
+        mock_restart.assert_not_called()
+        self.assertEqual(self.nginx_commands, [])
+
+    def test_open_file_cache(self):
+        with self.container.pull("/etc/nginx/sites-available/default") as f:
+            nginx_config = f.read()
+        self.assertIn("open_file_cache max=1000 inactive=60s;", nginx_config)
+        self.assertIn("open_file_cache_valid 30s;", nginx_config)
+        self.assertNotIn("aio threads;", nginx_config)
+
+    def test_static_file_settings(self):
+        self.harness.update_config(
+            {"open-file-cache-max": 0, "aio-threads": True, "open-file-cache-valid": 5}
+        )
+        with self.container.pull("/etc/nginx/sites-available/default") as f:
+            nginx_config = f.read()
+        self.assertNotIn("open_file_cache", nginx_config)
+        self.assertIn("aio threads;", nginx_config)
+
+    def test_drain_timeout_changed_reloads_nginx(self):
+        with patch("ops.model.Container.restart") as mock_restart, patch(
+            "ops.model.Container.send_signal"
+        ) as mock_send_signal:
+            self.harness.update_config({"reload-drain-timeout": 60})
+        mock_restart.assert_not_called()
+        mock_send_signal.assert_called_once_with("SIGHUP", "dashboard")
+        with self.container.pull("/etc/nginx/nginx.conf") as f:
+            self.assertIn("worker_shutdown_timeout 60s;", f.read())
+
+    def test_workers_sized_for_cgroup(self):
+        self.container.push("/sys/fs/cgroup/cpu.max", "150000 100000\n", make_dirs=True)
+        self.container.push("/sys/fs/cgroup/memory.max", "268435456\n")
+        self.container.push("/sys/fs/cgroup/cpuset.cpus.effective", "0-7,12-15\n")
+        self.harness.container_pebble_ready("dashboard")
+        with self.container.pull("/etc/nginx/nginx.conf") as f:
+            nginx_config = f.read()
+        self.assertIn("worker_processes 2;", nginx_config)
+        self.assertIn("worker_connections 2048;", nginx_config)
+        self.assertIn("worker_rlimit_nofile 4096;", nginx_config)
+        self.harness.update_config({"worker-processes": 4, "worker-connections": 512})
+        with self.container.pull("/etc/nginx/nginx.conf") as f:
+            nginx_config = f.read()
+        self.assertIn("worker_processes 4;", nginx_config)
+        self.assertIn("worker_connections 512;", nginx_config)
+        self.assertIn("worker_rlimit_nofile 1024;", nginx_config)
+
+    def test_workers_sized_for_workload_cpus(self):
+        # The workload can only use one CPU, whatever the charm's container can use.
+        self.container.push(
+            "/sys/fs/cgroup/cpuset.cpus.effective", "3\n", make_dirs=True
+        )
+        self.harness.container_pebble_ready("dashboard")
+        with self.container.pull("/etc/nginx/nginx.conf") as f:
+            self.assertIn("worker_processes 1;", f.read())
+
+    def test_workers_without_cgroup_limits(self):
+        # nginx starts a worker for each CPU when the workload's CPUs aren't known.
+        with self.container.pull("/etc/nginx/nginx.conf") as f:
+            nginx_config = f.read()
+        self.assertIn("worker_processes auto;", nginx_config)
+        self.assertIn("worker_connections 4096;", nginx_config)
+
+    def test_index_template_cached(self):
+        with patch("ops.model.Container.pull") as mock_pull:
+            self.harness.update_config({"analytics-enabled": False})
+            self.harness.charm.on.update_status.emit()
+        mock_pull.assert_not_called()
+
+    def test_pebble_ready_fetches_index_template(self):
+        self.container.push(
+            "/srv/index.charm.html", '<base href="{{base_app_url}}" /><title />'
+        )
+        self.harness.container_pebble_ready("dashboard")
+        with self.container.pull("/srv/index.html") as f:
+            index_html = f.read()
+        self.assertEqual(index_html, '<base href="/" /><title />')
+
+    def test_unchanged_files_not_pushed(self):
+        self.harness.charm.reconciler.invalidate("testing")
+        with patch("ops.model.Container.push") as mock_push, patch(
+            "ops.model.Container.send_signal"
+        ) as mock_send_signal:
+            self.harness.charm.on.update_status.emit()
+        mock_push.assert_not_called()
+        mock_send_signal.assert_not_called()
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    def test_config_js_hashed(self):
+        [config] = self.container.list_files("/srv", pattern="config.*.js")
+        with self.container.pull("/srv/index.html") as f:
+            index_html = f.read()
+        self.assertIn(f'<script src="{config.name}"></script>', index_html)
+        self.harness.update_config({"analytics-enabled": False})
+        with self.container.pull("/srv/index.html") as f:
+            index_html = f.read()
+        self.assertNotIn(config.name, index_html)
+        self.assertIn("analyticsEnabled: false", self._read_config())
+        # The previous version is kept for browsers that loaded the previous index.html.
+        configs = self.container.list_files("/srv", pattern="config.*.js")
+        self.assertEqual(len(configs), 2)
+        self.assertIn(config.name, [file.name for file in configs])
+
+    def test_previous_config_js_removed(self):
+        [first] = self.container.list_files("/srv", pattern="config.*.js")
+        self.harness.update_config({"analytics-enabled": False})
+        [second] = [
+            file
+            for file in self.container.list_files("/srv", pattern="config.*.js")
+            if file.name != first.name
+        ]
+        # Each version is removed once it has been superseded for long enough, but the
+        # version that has just been superseded is kept.
+        later = time.time() + CONFIG_RETENTION + 30
+        with patch("charm.time.time", return_value=later):
+            self.harness.update_relation_data(
+                self.rel_id, "controller", {"identity-provider-url": "https://idp"}
+            )
+        names = {
+            file.name
+            for file in self.container.list_files("/srv", pattern="config.*.js")
+        }
+        self.assertNotIn(first.name, names)
+        self.assertIn(second.name, names)
+        self.assertEqual(len(names), 2)
+
+    def test_reused_config_js_kept(self):
+        [first] = self.container.list_files("/srv", pattern="config.*.js")
+        self.harness.update_config({"analytics-enabled": False})
+        # The first version is used again, so it is not superseded by the second.
+        self.harness.update_config({"analytics-enabled": True})
+        with self.container.pull("/srv/index.html") as f:
+            self.assertIn(first.name, f.read())
+        later = time.time() + CONFIG_RETENTION + 30
+        with patch("charm.time.time", return_value=later):
+            self.harness.update_config({"analytics-enabled": False})
+        names = {
+            file.name
+            for file in self.container.list_files("/srv", pattern="config.*.js")
+        }
+        self.assertIn(first.name, names)
+        self.assertEqual(len(names), 2)
+
+    def test_inlined_config_js_removed(self):
+        [config] = self.container.list_files("/srv", pattern="config.*.js")
+        self.harness.update_config({"inline-config": True})
+        self.harness.charm.on.update_status.emit()
+        [previous] = self.container.list_files("/srv", pattern="config.*.js")
+        self.assertEqual(previous.name, config.name)
+        # The config.js that index.html referred to before is removed once it has been
+        # superseded for long enough, even though no other version has been written.
+        later = time.time() + CONFIG_RETENTION + 30
+        with patch("charm.time.time", return_value=later):
+            self.harness.charm.on.update_status.emit()
+        self.assertEqual(self.container.list_files("/srv", pattern="config.*.js"), [])
+
+    def test_inline_config(self):
+        [config] = self.container.list_files("/srv", pattern="config.*.js")
+        self.harness.update_config({"inline-config": True})
+        with self.container.pull("/srv/index.html") as f:
+            index_html = f.read()
+        self.assertIn("<script>\nvar jujuDashboardConfig = {", index_html)
+        self.assertNotIn("config.", index_html)
+        # The previous config.js is kept for browsers that loaded the previous
+        # index.html.
+        [previous] = self.container.list_files("/srv", pattern="config.*.js")
+        self.assertEqual(previous.name, config.name)
+        # The same config.js is used again when it is no longer inlined.
+        self.harness.update_config({"inline-config": False})
+        [new_config] = self.container.list_files("/srv", pattern="config.*.js")
+        self.assertEqual(new_config.name, config.name)
+        self.assertIn("isJuju: true", self._read_config())
+
+    def test_preloads_modules_from_manifest(self):
+        self.container.push(
+            "/srv/index.charm.html",
+            '<head><script type="module" src="assets/index-a1.js"></script></head>',
+        )
+        self.container.push(
+            "/srv/.vite/manifest.json",
+            json.dumps(
+                {
+                    "index.charm.html": {
+                        "file": "assets/index-a1.js",
+                        "imports": ["_vendor-b2.js"],
+                        "dynamicImports": ["src/lazy.tsx"],
+                        "css": ["assets/index-c3.css"],
+                    },
+                    "_vendor-b2.js": {"file": "assets/vendor-b2.js"},
+                    "src/lazy.tsx": {"file": "assets/lazy-d4.js"},
+                }
+            ),
+            make_dirs=True,
+        )
+        self.harness.container_pebble_ready("dashboard")
+        with self.container.pull("/srv/index.html") as f:
+            index_html = f.read()
+        self.assertIn(
+            '<link rel="modulepreload" crossorigin href="assets/vendor-b2.js" />',
+            index_html,
+        )
+        self.assertNotIn('href="assets/index-a1.js"', index_html)
+        self.assertNotIn("lazy", index_html)
+        with self.container.pull("/etc/nginx/sites-available/default") as f:
+            nginx_config = f.read()
+        self.assertIn(
+            'add_header Link "</assets/index-a1.js>; rel=modulepreload; crossorigin, '
+            "</assets/vendor-b2.js>; rel=modulepreload; crossorigin, "
+            '</assets/index-c3.css>; rel=preload; as=style";',
+            nginx_config,
+        )
+
+    def _add_controller_units(self):
+        self.harness.update_relation_data(
+            self.rel_id, "controller/0", {"ingress-address": "10.10.10.1"}
+        )
+        for unit, address in (
+            ("controller/1", "10.10.10.2"),
+            ("controller/2", "fd00::3"),
+        ):
+            self.harness.add_relation_unit(self.rel_id, unit)
+            self.harness.update_relation_data(
+                self.rel_id, unit, {"ingress-address": address}
+            )
+
+    @patch("probe.measure_latency", return_value=0.01)
+    def test_ha_controller_upstream(self, _):
+        self._add_controller_units()
+        with self.container.pull("/etc/nginx/sites-available/default") as f:
+            nginx_config = f.read()
+        self.assertIn("least_conn;", nginx_config)
+        self.assertIn("server 10.10.10.1:107070 max_fails=3", nginx_config)
+        self.assertIn("server 10.10.10.2:107070 max_fails=3", nginx_config)
+        self.assertIn("server [fd00::3]:107070 max_fails=3", nginx_config)
+        self.harness.remove_relation_unit(self.rel_id, "controller/1")
+        with self.container.pull("/etc/nginx/sites-available/default") as f:
+            nginx_config = f.read()
+        self.assertNotIn("10.10.10.2", nginx_config)
+        self.assertIn("server [fd00::3]:107070 max_fails=3", nginx_config)
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    @patch("probe.measure_latency", return_value=0.01)
+    def test_ha_controller_url_is_a_unit(self, _):
+        # The controller URL names controller/0 by its hostname, while the unit data
+        # gives its IP address, so it isn't added to the upstream a second time.
+        self.harness.update_relation_data(
+            self.rel_id, "controller", {"controller-url": "wss://juju-0.example:107070"}
+        )
+        self._add_controller_units()
+        with self.container.pull("/etc/nginx/sites-available/default") as f:
+            nginx_config = f.read()
+        self.assertNotIn("juju-0.example", nginx_config)
+        servers = [line for line in nginx_config.splitlines() if "max_fails" in line]
+        self.assertEqual(len(servers), 3)
+
+    def test_ha_controller_prefers_nearest(self):
+        latencies = {
+            "10.10.10.1:107070": 0.2,
+            "10.10.10.2:107070": 0.01,
+            "[fd00::3]:107070": None,
+        }
+        with patch("probe.measure_latency", side_effect=latencies.get) as mock_measure:
+            self._add_controller_units()
+            self.harness.charm.on.update_status.emit()
+        # Measurements are reused until they expire.
+        self.assertEqual(mock_measure.call_count, 3)
+        with self.container.pull("/etc/nginx/sites-available/default") as f:
+            nginx_config = f.read()
+        servers = [
+            line.strip() for line in nginx_config.splitlines() if "max_fails" in line
+        ]
+        self.assertEqual(
+            servers,
+            [
+                "server 10.10.10.2:107070 max_fails=3 fail_timeout=30s;",
+                "server 10.10.10.1:107070 max_fails=3 fail_timeout=30s backup;",
+                "server [fd00::3]:107070 max_fails=3 fail_timeout=30s backup;",
+            ],
+        )
+
+    def test_proxy_settings(self):
+        with self.container.pull("/etc/nginx/sites-available/default") as f:
+            nginx_config = f.read()
+        self.assertIn("proxy_connect_timeout 5s;", nginx_config)
+        self.assertIn("proxy_read_timeout 3600s;", nginx_config)
+        self.assertIn("proxy_buffering off;", nginx_config)
+        self.harness.update_config(
+            {"proxy-read-timeout": 600, "proxy-socket-keepalive": False}
+        )
+        with self.container.pull("/etc/nginx/sites-available/default") as f:
+            nginx_config = f.read()
+        self.assertIn("proxy_read_timeout 600s;", nginx_config)
+        self.assertIn("proxy_socket_keepalive off;", nginx_config)
+
+    def test_controller_ca_cert(self):
+        with self.container.pull("/etc/nginx/sites-available/default") as f:
+            nginx_config = f.read()
+        self.assertIn("proxy_ssl_session_reuse on;", nginx_config)
+        self.assertNotIn("proxy_ssl_verify", nginx_config)
+        self.harness.update_relation_data(
+            self.rel_id, "controller", {"ca-cert": "-----BEGIN CERTIFICATE-----"}
+        )
+        with self.container.pull("/etc/nginx/juju-controller-ca.pem") as f:
+            self.assertEqual(f.read(), "-----BEGIN CERTIFICATE-----")
+        with self.container.pull("/etc/nginx/sites-available/default") as f:
+            nginx_config = f.read()
+        self.assertIn(
+            "proxy_ssl_trusted_certificate /etc/nginx/juju-controller-ca.pem;",
+            nginx_config,
+        )
+        self.assertIn("proxy_ssl_verify on;", nginx_config)
+        self.assertIn("proxy_ssl_name juju-apiserver;", nginx_config)
+        # nginx is reloaded when the CA changes, so that it is used for new connections.
+        with patch("ops.model.Container.send_signal") as mock_send_signal:
+            self.harness.update_relation_data(
+                self.rel_id, "controller", {"ca-cert": "-----NEW CERTIFICATE-----"}
+            )
+        mock_send_signal.assert_called_once_with("SIGHUP", "dashboard")
+
+
+class TestUpdateDatabag(unittest.TestCase):
+    def test_only_changed_keys_written(self):
+        databag = {"port": "8080", "host": "dashboard"}
+        with patch.dict(databag) as patched:
+            self.assertFalse(update_databag(patched, {"port": "8080"}))
+        self.assertTrue(update_databag(databag, {"port": "123"}))
+        self.assertEqual(databag, {"port": "123", "host": "dashboard"})
+
+    def test_clear(self):
+        databag = {"port": "8080", "host": "dashboard"}
+        self.assertTrue(update_databag(databag, {"port": "8080"}, clear=True))
+        self.assertEqual(databag, {"port": "8080"})
+        self.assertFalse(update_databag(databag, {"port": "8080"}, clear=True))
+
+
+class TestPreloadLink(unittest.TestCase):
+    def test_preload_link(self):
+        preloads = {
+            "modules": ["assets/index-a1.js"],
+            "styles": ["assets/index-c3.css"],
+        }
+        for base_app_url in ("", "/", "/juju-dashboard", "/juju-dashboard/"):
+            prefix = base_app_url.rstrip("/")
+            with self.subTest(base_app_url=base_app_url):
+                self.assertEqual(
+                    preload_link(preloads, base_app_url),
+                    f"<{prefix}/assets/index-a1.js>; rel=modulepreload; crossorigin, "
+                    f"<{prefix}/assets/index-c3.css>; rel=preload; as=style",
+                )
+
+
+class TestCpusetSize(unittest.TestCase):
+    def test_cpuset_size(self):
+        self.assertEqual(cpuset_size("0-7,12-15\n"), 12)
+        self.assertEqual(cpuset_size("3"), 1)
+        self.assertIsNone(cpuset_size("\n"))
+        self.assertIsNone(cpuset_size(None))
+
+
+class TestStaleConfigNames(unittest.TestCase):
+    def test_previous_versions_kept(self):
+        superseded = {
+            "config.aaaaaaaaaaaa.js": 200,
+            "config.bbbbbbbbbbbb.js": 300,
+            "config.js": 0,
+        }
+        self.assertEqual(
+            stale_config_names(superseded, 200 + CONFIG_RETENTION),
+            ["config.aaaaaaaaaaaa.js"],
+        )
+        self.assertEqual(
+            stale_config_names(superseded, 300 + CONFIG_RETENTION),
+            ["config.aaaaaaaaaaaa.js", "config.bbbbbbbbbbbb.js"],
+        )
+        # Versions are kept for longer when nginx may serve a cached index.html.
+        self.assertEqual(
+            stale_config_names(superseded, 200 + CONFIG_RETENTION, 30),
+            [],
+        )
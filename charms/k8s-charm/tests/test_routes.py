@@ -0,0 +1,207 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import re
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from config import NGINX_CONF, Config
+
+SRC_DIR = Path(__file__).parent.parent / "src"
+# The templates are compiled into a cache next to them, so they are rendered from a copy
+# rather than writing to src.
+CONFIG_DIR = tempfile.TemporaryDirectory()
+UUID = "84e872ff-9171-46be-829b-70f0ce94a5a7"
+INDEX = ("file", "/srv/index.html")
+
+# The path of each request, relative to the base URL, and how it should be handled.
+ROUTES = [
+    ("/", INDEX),
+    ("/controllers", INDEX),
+    ("/models", INDEX),
+    ("/models/admin/default", INDEX),
+    # A model that is named "api" is a page in the app, not the controller's API.
+    ("/models/admin/api", INDEX),
+    ("/config.js", ("file", "/srv/config.js")),
+    ("/config.0123456789ab.js", ("file", "/srv/config.0123456789ab.js")),
+    ("/config.py", INDEX),
+    ("/favicon.ico", ("file", "/srv/favicon.ico")),
+    ("/manifest.json", ("file", "/srv/manifest.json")),
+    ("/assets/index-B2x9c0aF.js", ("file", "/srv/assets/index-B2x9c0aF.js")),
+    ("/assets", INDEX),
+    ("/api", ("proxy", "/api")),
+    ("/commands", ("proxy", "/commands")),
+    (f"/model/{UUID}/api", ("proxy", f"/model/{UUID}/api")),
+    (f"/model/{UUID}/commands", ("proxy", f"/model/{UUID}/commands")),
+    (f"/model/{UUID}/charms", INDEX),
+]
+BASE_APP_URLS = ["", "/dashboard", "/juju-dashboard/"]
+
+
+def parse(text):
+    """Parse an nginx config into a list of `(name, args, children)` directives."""
+    text = re.sub(r"#[^\n]*", "", text)
+    tokens = re.findall(r"\"[^\"]*\"|'[^']*'|[{};]|[^\s{};]+", text)
+    tokens.reverse()
+
+    def block():
+        directives = []
+        args = []
+        while tokens:
+            token = tokens.pop()
+            if token == "}":
+                break
+            if token in ("{", ";"):
+                children = block() if token == "{" else None
+                directives.append((args[0], args[1:], children))
+                args = []
+            else:
+                args.append(token)
+        return directives
+
+    return block()
+
+
+def locations(directives):
+    """Return the `(modifier, path, directives)` of each location in a block."""
+    return [
+        (args[0] if len(args) > 1 else "", args[-1], children)
+        for name, args, children in directives
+        if name == "location"
+    ]
+
+
+def find_location(directives, uri):
+    """Choose the location for a request the way that nginx does.
+
+    Returns the location and the match of its regular expression, if it has one.
+    """
+    candidates = locations(directives)
+    for modifier, path, children in candidates:
+        if modifier == "=" and path == uri:
+            return (modifier, path, children), None
+    prefixes = [
+        location
+        for location in candidates
+        if location[0] in ("", "^~") and uri.startswith(location[1])
+    ]
+    longest = max(prefixes, key=lambda location: len(location[1]), default=None)
+    if longest is not None:
+        nested = find_location(longest[2], uri)
+        if nested[0] is not None:
+            return nested
+        if longest[0] == "^~":
+            return longest, None
+    for modifier, path, children in candidates:
+        if modifier == "~":
+            match = re.search(path, uri)
+            if match:
+                return (modifier, path, children), match
+    return longest, None
+
+
+def route(nginx_config, uri):
+    """Return whether a request is served from a file or proxied, and to where."""
+    server = next(
+        children for name, _, children in parse(nginx_config) if name == "server"
+    )
+    root = next(args[0] for name, args, _ in server if name == "root")
+    location, match = find_location(server, uri)
+    directives = {name: args for name, args, _ in location[2]}
+    if "rewrite" in directives:
+        pattern, replacement = directives["rewrite"][:2]
+        uri = re.sub(pattern, replacement.replace("$1", r"\1"), uri)
+    if "proxy_pass" in directives:
+        return ("proxy", uri)
+    if "return" in directives:
+        return ("return", directives["return"][0])
+    if "alias" in directives:
+        return ("file", directives["alias"][0] + uri.removeprefix(location[1]))
+    path = directives["try_files"][0].replace("$uri", uri)
+    if match:
+        path = path.replace("$1", match.group(1))
+    return ("file", root + path)
+
+
+def setUpModule():
+    for template in SRC_DIR.glob("*.j2"):
+        shutil.copy(template, CONFIG_DIR.name)
+
+
+def tearDownModule():
+    CONFIG_DIR.cleanup()
+
+
+def render_nginx_config(
+    base_app_url,
+    strip_prefix=False,
+    is_juju=True,
+    controller_url="wss://10.10.10.1:17070",
+):
+    config = Config(
+        config_dir=CONFIG_DIR.name,
+        controller_url=controller_url,
+        identity_provider_url=None,
+        is_juju=is_juju,
+        dashboard_root="/srv",
+        analytics_enabled=True,
+        port=8080,
+        base_app_url=base_app_url,
+        strip_prefix=strip_prefix,
+    )
+    return config.render([NGINX_CONF])[NGINX_CONF]
+
+
+class TestRoutes(unittest.TestCase):
+    def test_routes(self):
+        for base_app_url in BASE_APP_URLS:
+            nginx_config = render_nginx_config(base_app_url)
+            prefix = base_app_url.rstrip("/")
+            for path, expected in ROUTES:
+                with self.subTest(base_app_url=base_app_url, path=path):
+                    self.assertEqual(route(nginx_config, prefix + path), expected)
+
+    def test_routes_with_prefix_stripped(self):
+        for base_app_url in BASE_APP_URLS:
+            nginx_config = render_nginx_config(base_app_url, strip_prefix=True)
+            for path, expected in ROUTES:
+                with self.subTest(base_app_url=base_app_url, path=path):
+                    self.assertEqual(route(nginx_config, path), expected)
+
+    def test_health_check(self):
+        # Load balancers check each unit directly, so the path doesn't include the base URL.
+        for base_app_url in BASE_APP_URLS:
+            for strip_prefix in (False, True):
+                nginx_config = render_nginx_config(base_app_url, strip_prefix)
+                with self.subTest(base_app_url=base_app_url, strip_prefix=strip_prefix):
+                    self.assertEqual(route(nginx_config, "/healthz"), ("return", "200"))
+
+    def test_base_app_url_without_slash(self):
+        nginx_config = render_nginx_config("/dashboard")
+        self.assertEqual(route(nginx_config, "/dashboard"), INDEX)
+
+    def test_routes_without_controller(self):
+        nginx_config = render_nginx_config("/dashboard", is_juju=False)
+        for path in ("/api", "/commands", f"/model/{UUID}/api"):
+            with self.subTest(path=path):
+                self.assertEqual(route(nginx_config, f"/dashboard{path}"), INDEX)
+
+    def test_routes_before_controller_is_related(self):
+        nginx_config = render_nginx_config("/dashboard", controller_url="")
+        self.assertNotIn("upstream controller", nginx_config)
+        for path in ("/api", "/commands", f"/model/{UUID}/api"):
+            with self.subTest(path=path):
+                self.assertEqual(route(nginx_config, f"/dashboard{path}"), INDEX)
+
+    def test_no_regex_locations(self):
+        # Only the locations nested inside a prefix are matched by a regex, so most
+        # requests aren't checked against one.
+        server = next(
+            children
+            for name, _, children in parse(render_nginx_config("/dashboard"))
+            if name == "server"
+        )
+        modifiers = {modifier for modifier, _, _ in locations(server)}
+        self.assertEqual(modifiers, {"", "=", "^~"})
@@ -12,8 +12,9 @@ DASHBOARD_VERSION="${2:-}"
 IFS=' ' read -r -a PACK_ARGS <<< "${3:-}"
 
 # 1. Build or reuse the Juju Dashboard assets
+# The build includes hidden files, such as the Vite manifest in .vite.
+rm -rf "$CHARM_DIST_PATH"
 mkdir -p "$CHARM_DIST_PATH"
-rm -rf "$CHARM_DIST_PATH"/*
 
 if [ "$BUILD_TYPE" == "source" ]; then
     # Navigate to the root and build it in a subshell
@@ -21,7 +22,7 @@ if [ "$BUILD_TYPE" == "source" ]; then
         cd "$ROOT_DIR"
         yarn install
         yarn build
-        cp -r "$ROOT_DIR/$BUILD_OUTPUT"/* "$CHARM_DIST_PATH"/
+        cp -r "$ROOT_DIR/$BUILD_OUTPUT"/. "$CHARM_DIST_PATH"/
     )
 
 elif [ "$BUILD_TYPE" == "dashboard-version" ]; then
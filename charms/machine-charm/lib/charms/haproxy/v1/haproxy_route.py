@@ -143,6 +143,9 @@ from pydantic import (
 from pydantic.dataclasses import dataclass
 from typing_extensions import Self
 
+# Patched: databags are only written when their contents change.
+from charms.juju_dashboard.v0.juju_dashboard import update_databag
+
 # The unique Charmhub library identifier, never change it
 LIBID = "08b6347482f6455486b5f5bb4dc4e6cf"
 
@@ -276,22 +279,22 @@ class _DatabagModel(BaseModel):
         Returns:
             MutableMapping: The databag.
         """
-        if clear and databag:
-            databag.clear()
-
-        if databag is None:
-            databag = {}
         nest_under = self.model_config.get("_NEST_UNDER")
         if nest_under:
-            databag[nest_under] = self.model_dump_json(
-                by_alias=True,
-                # skip keys whose values are default
-                exclude_defaults=True,
-            )
-            return databag
+            data = {
+                nest_under: self.model_dump_json(
+                    by_alias=True,
+                    # skip keys whose values are default
+                    exclude_defaults=True,
+                )
+            }
+        else:
+            dct = self.model_dump(mode="json", by_alias=True, exclude_defaults=True)
+            data = {k: json.dumps(v) for k, v in dct.items()}
 
-        dct = self.model_dump(mode="json", by_alias=True, exclude_defaults=True)
-        databag.update({k: json.dumps(v) for k, v in dct.items()})
+        if databag is None:
+            return data
+        update_databag(databag, data, clear=clear)
         return databag
 
 
@@ -6,7 +6,8 @@ with a url to connect to, as well as optional additional configuration informati
 """
 import re
 from subprocess import check_output
-from typing import Mapping
+from typing import Mapping, MutableMapping
+from urllib.parse import urlsplit, urlunsplit
 
 from ops.charm import CharmBase
 from ops.model import Application, Relation
@@ -19,7 +20,55 @@ LIBAPI = 0
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 1
+LIBPATCH = 2
+
+
+def update_databag(databag: MutableMapping, data: Mapping, clear: bool = False) -> bool:
+    """Write the keys of `data` whose values differ from those already in the databag.
+
+    Each write is a hook tool call and can trigger relation-changed on the other side of
+    the relation, which may respond by writing its own data, so values that are
+    unchanged are not written again. When `clear` is set, any keys that aren't in
+    `data` are removed. Returns whether the databag was changed.
+    """
+    changed = False
+    if clear:
+        for key in [key for key in databag if key not in data]:
+            del databag[key]
+            changed = True
+    for key, value in data.items():
+        if databag.get(key) != value:
+            databag[key] = value
+            changed = True
+    return changed
+
+
+def _controller_urls(controller_url, units_data):
+    """Return a URL for each controller unit.
+
+    The controller only provides a single URL, so the units of an HA controller are
+    reached at their ingress addresses using the same scheme and port. The URL that the
+    controller provides may name one of the units by a different address, so it is only
+    used when no unit has an ingress address, otherwise that unit would be listed twice.
+    The URLs are sorted, as the units aren't listed in a consistent order.
+    """
+    if not controller_url:
+        return []
+    parts = urlsplit(controller_url)
+    if not parts.netloc:
+        return [controller_url]
+    urls = []
+    port = re.search(r":\d+$", parts.netloc)
+    for unit_data in units_data:
+        address = unit_data.get("ingress-address")
+        if not address:
+            continue
+        host = f"[{address}]" if ":" in address else address
+        netloc = f"{host}{port.group()}" if port else host
+        url = urlunsplit(parts._replace(netloc=netloc))
+        if url not in urls:
+            urls.append(url)
+    return sorted(urls) or [controller_url]
 
 
 class JujuDashReq:
@@ -44,19 +93,21 @@ class JujuDashReq:
             provider: The Application providing the controller data. Usually a
                 juju-controller application.
         """
-        self.data = JujuDashData(relation.data[provider])
+        self.data = JujuDashData(
+            relation.data[provider], [relation.data[unit] for unit in relation.units]
+        )
 
         # Update the relation with our own ingress ip
         if charm.unit.is_leader():
             # TODO: handle the situation where there are multiple dashes, and the endpoint
             # is the haproxy address.
             ip = check_output(["unit-get", "public-address"]).decode().strip()
-            relation.data[charm.model.app]['dashboard-ingress'] = ip
+            update_databag(relation.data[charm.model.app], {'dashboard-ingress': ip})
 
 
 class JujuDashData(Mapping):
 
-    def __init__(self, data):
+    def __init__(self, data, units_data=()):
         """Parse the config data from the controller into a Mapping.
 
         Note: The controller charm provides the full controller path but we use this path
@@ -64,15 +115,18 @@ class JujuDashData(Mapping):
         "/api" suffix.
 
         Args:
-            relation: the relation with the Juju controller. Usually even.relation in a
-                relation handler.
+            data: the application data provided by the controller.
 
-            provider: The Application providing the controller data. Usually a
-                juju-controller application.
+            units_data: the unit data of each controller unit, which is used to find
+                every unit of an HA controller.
 
         """
+        controller_url = re.sub(r'\/api$', '', data.get("controller-url", ""))
         self._data = {
-            "controller_url": re.sub(r'\/api$', '', data.get("controller-url", "")),
+            "controller_url": controller_url,
+            "controller_urls": _controller_urls(controller_url, units_data),
+            # The CA that issued the controller's certificate, if it is provided.
+            "controller_ca_cert": data.get("ca-cert") or None,
             "identity_provider_url": data.get("identity-provider-url", ""),
             "is_juju": data.get("is-juju", True),
         }
@@ -8,18 +8,46 @@ import logging
 import os
 from pathlib import Path
 
-from charms.haproxy.v1.haproxy_route import HaproxyRouteRequirer
-from charms.juju_dashboard.v0.juju_dashboard import JujuDashData, JujuDashReq
+from charms.haproxy.v1.haproxy_route import HaproxyRouteRequirer, LoadBalancingAlgorithm
+from charms.juju_dashboard.v0.juju_dashboard import (
+    JujuDashData,
+    JujuDashReq,
+    update_databag,
+)
 from charms.nginx_ingress_integrator.v0.nginx_route import require_nginx_route
 from ops.charm import CharmBase
 from ops.framework import StoredState
 from ops.main import main
 from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus
 
-from config import Config, to_bool
+from config import (
+    ARTIFACTS,
+    CGROUP_CPU_MAX,
+    CGROUP_MEMORY_MAX,
+    CONFIG_JS,
+    CONTROLLER_CA,
+    NGINX_CONF,
+    NGINX_MAIN_CONF,
+    Config,
+    compress_assets,
+    read_file,
+    to_bool,
+    upstream_server,
+    worker_settings,
+)
+from probe import LatencyProbe
+from reconcile import Reconciler
 
 logger = logging.getLogger(__name__)
 
+# The charm's templates. The dashboard is built into the dist directory beside them.
+CONFIG_DIR = Path(__file__).parent.resolve()
+# Files in this directory enable nginx modules, such as brotli.
+NGINX_MODULES_DIR = "/etc/nginx/modules-enabled"
+ASSETS = "assets"
+# The paths of the controller websockets, which HAProxy routes to their own backend.
+WEBSOCKET_PATHS = ["/api", "/commands", "/model/"]
+
 
 class JujuDashboardCharm(CharmBase):
     """Juju Dashboard Charm
@@ -33,6 +61,9 @@ class JujuDashboardCharm(CharmBase):
     - The controller relation allows the dashboard to connect to a Juju controller.
     - The dashboard relation allows an http proxy to connect to the dashboard charm.
 
+    The dashboard is served as soon as the charm is installed. Until a controller is
+    related, nothing is proxied and the app reports that it isn't configured yet.
+
     """
 
     _stored = StoredState()
@@ -44,19 +75,35 @@ class JujuDashboardCharm(CharmBase):
             self.on["controller"].relation_changed, self._on_controller_relation_changed
         )
         self.framework.observe(
-            self.on["controller"].relation_departed, self._on_relation_departed
+            self.on["controller"].relation_departed, self._on_model_changed
+        )
+        self.framework.observe(
+            self.on["controller"].relation_broken, self._on_model_changed
         )
         self.framework.observe(
             self.on["dashboard"].relation_changed, self._on_dashboard_relation_changed
         )
         self.framework.observe(
-            self.on["dashboard"].relation_departed, self._on_relation_departed
+            self.on["dashboard"].relation_departed, self._on_model_changed
         )
         self.framework.observe(self.on.config_changed, self._on_config_changed)
         self.framework.observe(self.on.update_status, self._on_config_changed)
-        self.framework.observe(self.on.upgrade_charm, self._on_config_changed)
+        self.framework.observe(self.on.upgrade_charm, self._on_upgrade_charm)
+        self.framework.observe(
+            self.on["haproxy-route-websocket"].relation_created,
+            self._on_haproxy_route_websocket_changed,
+        )
+        self.framework.observe(
+            self.on["haproxy-route-websocket"].relation_broken,
+            self._on_haproxy_route_websocket_changed,
+        )
+        self.framework.observe(
+            self.on.reconcile_stats_action, self._on_reconcile_stats_action
+        )
 
         self._stored.set_default(controllerData={})
+        self.reconciler = Reconciler(self)
+        self.latency_probe = LatencyProbe(self)
 
         require_nginx_route(
             charm=self,
@@ -64,12 +111,57 @@ class JujuDashboardCharm(CharmBase):
             service_name=self.app.name,
             service_port=self.config.get("port"),
         )
-        self._haproxy_route_requirer = HaproxyRouteRequirer(
-            self,
-            "haproxy-route",
-            ports=[self.config.get("port")],
-            service=self.app.name,
-        )
+        self._haproxy_route_requirers = {
+            relation_name: HaproxyRouteRequirer(self, relation_name, **route)
+            for relation_name, route in self._haproxy_routes().items()
+        }
+
+    def _health_check(self):
+        """Have HAProxy stop sending requests to the unit if nginx stops responding."""
+        if not self.config.get("health-check-path"):
+            return {}
+        return {
+            "check_path": self.config.get("health-check-path"),
+            "check_interval": self.config.get("health-check-interval"),
+            "check_rise": self.config.get("health-check-rise"),
+            "check_fall": self.config.get("health-check-fall"),
+        }
+
+    def _haproxy_routes(self):
+        """Return the HAProxy routes for the static files and the controller websockets.
+
+        Websockets are long lived, so they are balanced by the number of connections that
+        each unit has open and are given a long timeout. Static files are requested often
+        and served quickly, so they are balanced in turn, time out quickly and are retried
+        on another unit. Until the websocket route is related, the static route carries
+        the websockets too, so it uses the websocket settings.
+        """
+        route = {"ports": [self.config.get("port")], **self._health_check()}
+        websocket = {
+            **route,
+            "load_balancing_algorithm": LoadBalancingAlgorithm.LEASTCONN,
+            "server_timeout": self.config.get("haproxy-websocket-timeout"),
+            "server_maxconn": self.config.get("haproxy-websocket-maxconn") or None,
+        }
+        static = websocket
+        if self.model.get_relation("haproxy-route-websocket"):
+            static = {
+                **route,
+                "load_balancing_algorithm": LoadBalancingAlgorithm.ROUNDROBIN,
+                "server_timeout": self.config.get("haproxy-static-timeout"),
+                "server_maxconn": self.config.get("haproxy-static-maxconn") or None,
+                "retry_count": self.config.get("haproxy-static-retries") or None,
+                "retry_redispatch": bool(self.config.get("haproxy-static-retries")),
+                "http_server_close": self.config.get("haproxy-http-server-close"),
+            }
+        return {
+            "haproxy-route": {"service": self.app.name, **static},
+            "haproxy-route-websocket": {
+                "service": f"{self.app.name}-websocket",
+                "paths": WEBSOCKET_PATHS,
+                **websocket,
+            },
+        }
 
     def _on_install(self, _):
         os.system("apt install -y nginx")  # FIXME: use linux system tools
@@ -77,59 +169,218 @@ class JujuDashboardCharm(CharmBase):
         self.unit.status = MaintenanceStatus("Awaiting controller relation.")
 
     def _on_dashboard_relation_changed(self, event):
-        event.relation.data[self.app]["port"] = self.config.get("port")
-        event.relation.data[self.unit]["port"] = self.config.get("port")
-
-    def _on_relation_departed(self, _):
-        self.unit.status = BlockedStatus("Missing controller integration")
+        port = str(self.config.get("port"))
+        if self.unit.is_leader():
+            update_databag(event.relation.data[self.app], {"port": port})
+        update_databag(event.relation.data[self.unit], {"port": port})
 
     def _on_controller_relation_changed(self, event):
         """A controller relation has been setup; configure our node service to talk to it."""
-        requires = JujuDashReq(self, event.relation, event.app)
-        if not requires.data["controller_url"]:
-            self.unit.status = BlockedStatus("Missing controller URL")
-            return
+        JujuDashReq(self, event.relation, event.app)
+        self._reconcile()
 
-        self._configure(**requires.data)
+    def _on_model_changed(self, _):
+        """Reconcile nginx with the model, e.g. when a controller unit departs."""
+        self._reconcile()
 
     def _on_config_changed(self, _):
-        relation = self.model.get_relation("controller")
-        if not relation:
-            self.unit.status = BlockedStatus("Missing controller integration")
-            return
+        self._reconcile()
+        self._provide_haproxy_routes()
+
+    def _reconcile(self):
+        """Configure nginx from the model's current state, if it has changed.
 
-        data = JujuDashData(relation.data[relation.app])
+        The state is read from the model rather than the event, so every event in a burst
+        sees the same state and only the first one configures nginx.
+        """
+        data = self._controller_data()
+        state = {
+            "config": dict(self.config),
+            "related": self.model.get_relation("controller") is not None,
+            "controller": dict(data),
+        }
+        # Controller units are probed again once their measurements expire.
+        servers = self._probed_servers(data["controller_urls"], data["is_juju"])
+        if not self.reconciler.coalesce(
+            state, force=self.latency_probe.expired(servers)
+        ):
+            return
         self._configure(**data)
-        self._haproxy_route_requirer.provide_haproxy_route_requirements(
-            self.app.name, ports=[self.config.get("port")]
+
+    def _controller_data(self):
+        """Return the data that the controller provides, which is empty until it is related."""
+        relation = self.model.get_relation("controller")
+        if not relation:
+            return JujuDashData({})
+        return JujuDashData(
+            relation.data[relation.app],
+            [relation.data[unit] for unit in relation.units],
         )
 
+    def _controller_status(self):
+        """Return the unit's status while nginx is serving the dashboard."""
+        if not self.model.get_relation("controller"):
+            return BlockedStatus("Missing controller integration")
+        if not self._controller_data()["controller_url"]:
+            return BlockedStatus("Missing controller URL")
+        return ActiveStatus()
+
+    def _on_haproxy_route_websocket_changed(self, _):
+        # The static route also carries the websockets when they have no route of their own.
+        self._provide_haproxy_routes()
+
+    def _provide_haproxy_routes(self):
+        for relation_name, route in self._haproxy_routes().items():
+            requirer = self._haproxy_route_requirers[relation_name]
+            requirer.provide_haproxy_route_requirements(**route)
+
+    def _on_reconcile_stats_action(self, event):
+        avoided = self.reconciler.avoided
+        event.set_results({"avoided": sum(avoided.values()), **avoided})
+
+    def _on_upgrade_charm(self, event):
+        self.reconciler.invalidate("the charm was upgraded")
+        self._on_config_changed(event)
+
     def _bool(self, boolean_variable):
         if type(boolean_variable) is str:
             return boolean_variable.lower() == "true"
         return boolean_variable
 
-    def _configure(self, controller_url, identity_provider_url, is_juju):
-        """Configure and restart our nginx and juju-dashboard services."""
+    def _configure(
+        self,
+        controller_url,
+        controller_urls,
+        controller_ca_cert,
+        identity_provider_url,
+        is_juju,
+    ):
+        """Configure and reload our nginx and juju-dashboard services.
+
+        Without a controller URL, the dashboard is still served, but nothing is proxied.
+        """
 
-        current_path = Path(__file__).parent.resolve()
         config = Config(
-            config_dir=str(current_path),
+            config_dir=str(CONFIG_DIR),
             controller_url=controller_url,
+            controller_urls=controller_urls,
+            controller_latencies=self._controller_latencies(controller_urls, is_juju),
+            proxy_connect_timeout=self.config.get("proxy-connect-timeout"),
+            proxy_read_timeout=self.config.get("proxy-read-timeout"),
+            proxy_send_timeout=self.config.get("proxy-send-timeout"),
+            proxy_buffering=self.config.get("proxy-buffering"),
+            proxy_tcp_nodelay=self.config.get("proxy-tcp-nodelay"),
+            proxy_socket_keepalive=self.config.get("proxy-socket-keepalive"),
+            controller_ca_cert=controller_ca_cert,
             identity_provider_url=identity_provider_url,
             is_juju=to_bool(is_juju),
             analytics_enabled=to_bool(self.config.get("analytics-enabled")),
-            dashboard_root=str(current_path / "dist"),
+            dashboard_root=str(CONFIG_DIR / "dist"),
             port=self.config.get("port"),
+            compression_level=self.config.get("compression-level"),
+            static_gzip_level=self.config.get("static-gzip-level"),
+            static_brotli_level=self._static_brotli_level(),
+            workers=self._workers(),
+            multi_accept=self.config.get("multi-accept"),
+            reuseport=self.config.get("reuseport"),
+            sendfile=self.config.get("sendfile"),
+            tcp_nopush=self.config.get("tcp-nopush"),
+            keepalive_timeout=self.config.get("keepalive-timeout"),
+            keepalive_requests=self.config.get("keepalive-requests"),
+            open_file_cache_max=self.config.get("open-file-cache-max"),
+            open_file_cache_valid=self.config.get("open-file-cache-valid"),
+            open_file_cache_min_uses=self.config.get("open-file-cache-min-uses"),
+            aio_threads=self.config.get("aio-threads"),
+            health_check_path=self.config.get("health-check-path"),
+            reload_drain_timeout=self.config.get("reload-drain-timeout"),
         )
-        config.write()
         self.unit.set_ports(self.config.get("port"))
-        nginx_status = os.system("sudo systemctl restart nginx")
-        # If restarting nginx returns a 0 status it should have been successful
-        if nginx_status == 0:
-            self.unit.status = ActiveStatus()
-        else:
-            self.unit.status = BlockedStatus("Could not start nginx")
+        assets = {
+            "gzip": self.config.get("static-gzip-level"),
+            "brotli": self._static_brotli_level(),
+        }
+        inputs = {**config.inputs(), ASSETS: assets}
+        changed = self.reconciler.changed_inputs(inputs)
+        if not changed:
+            self.reconciler.applied(inputs, {})
+            self.unit.status = self._controller_status()
+            return
+
+        if ASSETS in changed:
+            compress_assets(
+                str(CONFIG_DIR / "dist"),
+                static_gzip_level=assets["gzip"],
+                static_brotli_level=assets["brotli"],
+            )
+
+        outputs = config.render([name for name in changed if name in ARTIFACTS])
+        changed = self.reconciler.changed_outputs(outputs)
+        if not changed:
+            self.reconciler.applied(inputs, outputs)
+            self.unit.status = self._controller_status()
+            return
+
+        config.write(
+            write_config_js=CONFIG_JS in changed,
+            write_nginx=NGINX_CONF in changed,
+            write_controller_ca=CONTROLLER_CA in changed,
+            write_main_nginx=NGINX_MAIN_CONF in changed,
+        )
+        # nginx serves config.js straight from disk, so it only needs to be reloaded
+        # when its own config or the certificate it verifies the controller with changed.
+        reload = {NGINX_CONF, NGINX_MAIN_CONF, CONTROLLER_CA} & set(changed)
+        error = self._reload_nginx() if reload else None
+        if error:
+            # The config is written and validated again on the next attempt.
+            self.unit.status = BlockedStatus(error)
+            return
+        self.reconciler.applied(inputs, outputs)
+        self.unit.status = self._controller_status()
+
+    def _probed_servers(self, controller_urls, is_juju):
+        """Return the controller units that nginx proxies to."""
+        if not to_bool(is_juju):
+            return []
+        return [upstream_server(url) for url in controller_urls]
+
+    def _controller_latencies(self, controller_urls, is_juju):
+        """Measure the latency to each controller unit that nginx proxies to."""
+        return self.latency_probe.measure(
+            self._probed_servers(controller_urls, is_juju)
+        )
+
+    def _static_brotli_level(self):
+        """Only compress with brotli if nginx is able to serve the compressed files."""
+        if not any(Path(NGINX_MODULES_DIR).glob("*brotli*")):
+            return 0
+        return self.config.get("static-brotli-level")
+
+    def _workers(self):
+        """Size the nginx workers for the CPUs and memory that the unit can use."""
+        return worker_settings(
+            read_file(CGROUP_CPU_MAX),
+            read_file(CGROUP_MEMORY_MAX),
+            len(os.sched_getaffinity(0)),
+            processes=self.config.get("worker-processes"),
+            connections=self.config.get("worker-connections"),
+            rlimit_nofile=self.config.get("worker-rlimit-nofile"),
+        )
+
+    def _reload_nginx(self):
+        """Gracefully reload nginx once its new config has been validated.
+
+        An invalid config is not loaded, leaving nginx serving the previous one.
+
+        Returns why nginx is not running with the new config, or None if it is.
+        """
+        if os.system("sudo nginx -t") != 0:
+            logger.warning("Not reloading nginx as the config could not be validated.")
+            return "Invalid nginx config"
+        # Reloading keeps open websockets to the controller alive. If nginx is not
+        # running yet then this will start it instead.
+        if os.system("sudo systemctl reload-or-restart nginx") != 0:
+            return "Could not start nginx"
+        return None
 
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+# Copyright 2026 Canonical Ltd.
+# See LICENSE file for licensing details.
+"""Track what has been applied to the workload so that hooks can skip redundant work."""
+
+import hashlib
+import json
+import logging
+
+from ops.framework import Object, StoredState
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(data) -> str:
+    """Return a stable digest for any JSON serialisable value."""
+    encoded = json.dumps(data, sort_keys=True, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class Reconciler(Object):
+    """Compare the desired workload state against the state that was last applied.
+
+    Fingerprints of the inputs (relation data, charm config, ingress URL and templates)
+    and of the rendered outputs are persisted in StoredState for each artifact, so that
+    only the artifacts that have changed need to be rendered and applied. Nothing is
+    recorded until `applied` is called, so a hook that fails will be retried. The number
+    of reconciles that were avoided is counted for each reason, so that the savings can
+    be reported.
+
+    Every event that may affect the workload is coalesced into a generation: the
+    generation only advances when the state that the charm reads from the model changes
+    or the applied state is invalidated. A burst of events, such as one for each unit of
+    an HA controller or several events in the same dispatch, is reconciled once, and an
+    event that changes nothing returns after comparing a single fingerprint.
+    """
+
+    _stored = StoredState()
+
+    def __init__(self, charm):
+        super().__init__(charm, "reconciler")
+        self._stored.set_default(
+            inputs={},
+            outputs={},
+            avoided={},
+            state=None,
+            generation=0,
+            applied_generation=0,
+        )
+
+    def coalesce(self, state: dict, force: bool = False) -> bool:
+        """Return whether the workload needs to be reconciled for the model's state.
+
+        `state` is what the charm reads from the model, e.g. its config and relation
+        data, rather than the event that is being handled. `force` starts a new
+        generation even if the state is unchanged.
+        """
+        digest = fingerprint(state)
+        if force or digest != self._stored.state:
+            self._stored.state = digest
+            self._stored.generation += 1
+        if self._stored.generation == self._stored.applied_generation:
+            logger.debug(
+                "Skipping reconcile: generation %d is applied.", self._stored.generation
+            )
+            self.avoid("state-unchanged")
+            return False
+        return True
+
+    def changed_inputs(self, inputs: dict) -> list:
+        """Return the names of the artifacts whose inputs differ from those last applied."""
+        changed = [
+            name
+            for name, values in inputs.items()
+            if self._stored.inputs.get(name) != fingerprint(values)
+        ]
+        if changed:
+            logger.info("Reconciling: inputs have changed for %s.", ", ".join(changed))
+        else:
+            logger.debug("Skipping reconcile: inputs are unchanged.")
+            self.avoid("inputs-unchanged")
+        return changed
+
+    def changed_outputs(self, outputs: dict) -> list:
+        """Return the names of the rendered outputs that differ from those last applied."""
+        changed = [
+            name
+            for name, content in outputs.items()
+            if self._stored.outputs.get(name) != fingerprint(content)
+        ]
+        if changed:
+            logger.info("Rendered outputs have changed: %s.", ", ".join(changed))
+        else:
+            logger.info("Skipping reconcile: rendered outputs are unchanged.")
+            self.avoid("outputs-unchanged")
+        return changed
+
+    def applied(self, inputs: dict, outputs: dict):
+        """Record that the workload has been configured from these inputs and outputs.
+
+        The inputs are those of every artifact that is wanted, so anything recorded for
+        an artifact that is no longer wanted is forgotten and it will be applied in full
+        if it is wanted again.
+        """
+        self._stored.applied_generation = self._stored.generation
+        self._stored.inputs = {
+            name: fingerprint(values) for name, values in inputs.items()
+        }
+        self._stored.outputs = {
+            name: digest
+            for name, digest in {
+                **self._stored.outputs,
+                **{name: fingerprint(content) for name, content in outputs.items()},
+            }.items()
+            if name in inputs
+        }
+
+    def avoid(self, reason: str):
+        """Count a reconcile that was skipped for this reason."""
+        self._stored.avoided[reason] = self._stored.avoided.get(reason, 0) + 1
+
+    @property
+    def avoided(self) -> dict:
+        """Return the number of reconciles that have been skipped for each reason."""
+        return dict(self._stored.avoided)
+
+    def invalidate(self, reason: str):
+        """Forget the applied state so that the next reconcile runs in full."""
+        logger.info("Invalidating applied configuration: %s.", reason)
+        self._stored.generation += 1
+        self._stored.inputs = {}
+        self._stored.outputs = {}
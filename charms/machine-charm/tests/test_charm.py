@@ -1,13 +1,26 @@
 # Copyright 2021 Canonical
 # See LICENSE file for licensing details.
 
+import gzip
+import json
+import shutil
+import tempfile
 import unittest
+from pathlib import Path
 from unittest import mock
 
+from charms.juju_dashboard.v0.juju_dashboard import JujuDashData
 from ops.model import ActiveStatus, BlockedStatus
 from ops.testing import Harness
 
 import charm
+from config import (
+    Config,
+    compress_assets,
+    preload_assets,
+    preload_link,
+    worker_settings,
+)
 
 FAKE_ENDPOINT = {
     "bind-addresses": [
@@ -19,12 +32,25 @@ FAKE_ENDPOINT = {
     ],
     "ingress-addresses": ["10.10.10.11"],
 }
+SRC_DIR = Path(__file__).parent.parent / "src"
 
 
 class TestDashboardRelation(unittest.TestCase):
 
+    @mock.patch("config._write_atomic")
     @mock.patch("charm.os.system")
-    def setUp(self, mock_system):
+    def setUp(self, mock_system, mock_write):
+        mock_system.return_value = 0
+        # The templates are compiled into a cache beside them, so they are copied to a
+        # temporary directory that the tests can write to instead of src.
+        config_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(config_dir.cleanup)
+        for template in SRC_DIR.glob("*.j2"):
+            shutil.copy(template, config_dir.name)
+        self.config_dir = Path(config_dir.name)
+        patcher = mock.patch("charm.CONFIG_DIR", self.config_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
         self.haproxy_patcher = mock.patch("charm.HaproxyRouteRequirer")
         self.mock_haproxy_requirer = self.haproxy_patcher.start()
         self.harness = Harness(charm.JujuDashboardCharm)
@@ -41,7 +67,7 @@ class TestDashboardRelation(unittest.TestCase):
     def tearDown(self):
         self.haproxy_patcher.stop()
 
-    @mock.patch("pathlib.Path.write_text")
+    @mock.patch("config._write_atomic")
     @mock.patch("charm.os.system")
     def test_relation(self, mock_system, mock_write):
         mock_system.return_value = 0
@@ -60,8 +86,128 @@ class TestDashboardRelation(unittest.TestCase):
         # Verify that we tried to write templates.
         self.assertTrue(mock_write.called)
 
-    def test_missing_controller_url(self):
+    @mock.patch("config._write_atomic")
+    @mock.patch("charm.os.system")
+    def test_reload_nginx(self, mock_system, mock_write):
+        mock_system.return_value = 0
+        self.harness.update_relation_data(
+            self.rel_id,
+            "juju-controller",
+            {
+                "controller-url": "api/some/controller/url",
+                "identity-provider-url": "api/some/provider/url",
+                "is-juju": "True",
+            },
+        )
+        mock_system.assert_has_calls(
+            [
+                mock.call("sudo nginx -t"),
+                mock.call("sudo systemctl reload-or-restart nginx"),
+            ]
+        )
+        self.assertNotIn(
+            mock.call("sudo systemctl restart nginx"), mock_system.mock_calls
+        )
+        written = "".join(self._written_files(mock_write).values())
+        self.assertIn("proxy_pass https://controller;", written)
+
+    @mock.patch("config._write_atomic")
+    @mock.patch("charm.os.system")
+    def test_invalid_config_does_not_reload_nginx(self, mock_system, mock_write):
+        mock_system.side_effect = lambda command: 1 if command == "sudo nginx -t" else 0
+        self.harness.update_relation_data(
+            self.rel_id,
+            "juju-controller",
+            {
+                "controller-url": "api/some/controller/url",
+                "identity-provider-url": "api/some/provider/url",
+                "is-juju": "True",
+            },
+        )
+        mock_system.assert_called_once_with("sudo nginx -t")
+        self.assertEqual(
+            self.harness.model.unit.status, BlockedStatus("Invalid nginx config")
+        )
+        # The config is validated again on the next attempt, as it wasn't applied.
+        mock_system.reset_mock()
+        self.harness.charm.on.update_status.emit()
+        mock_system.assert_called_once_with("sudo nginx -t")
+
+    @mock.patch("config._write_atomic")
+    @mock.patch("charm.os.system")
+    def test_config_js_changed_does_not_reload_nginx(self, mock_system, mock_write):
+        mock_system.return_value = 0
+        self.harness.update_relation_data(
+            self.rel_id,
+            "juju-controller",
+            {
+                "controller-url": "api/some/controller/url",
+                "identity-provider-url": "api/some/provider/url",
+                "is-juju": "True",
+            },
+        )
+        written = "".join(self._written_files(mock_write).values())
+        self.assertIn("open_file_cache max=1000 inactive=60s;", written)
+        mock_system.reset_mock()
+        mock_write.reset_mock()
+        self.harness.update_config({"analytics-enabled": False})
+        mock_write.assert_called_once()
+        self.assertIn("analyticsEnabled: false", mock_write.call_args.args[1].decode())
+        mock_system.assert_not_called()
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    @mock.patch("config._write_atomic")
+    @mock.patch("charm.os.system")
+    def test_update_status_unchanged(self, mock_system, mock_write):
+        mock_system.return_value = 0
+        self.harness.update_relation_data(
+            self.rel_id,
+            "juju-controller",
+            {
+                "controller-url": "api/some/controller/url",
+                "identity-provider-url": "api/some/provider/url",
+                "is-juju": "True",
+            },
+        )
+        mock_system.reset_mock()
+        mock_write.reset_mock()
+        self.harness.charm.on.update_status.emit()
+        mock_system.assert_not_called()
+        mock_write.assert_not_called()
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    @mock.patch("config._write_atomic")
+    @mock.patch("charm.os.system")
+    def test_events_coalesced(self, mock_system, mock_write):
+        mock_system.return_value = 0
+        self.harness.disable_hooks()
+        self.harness.update_config({"analytics-enabled": False})
+        self.harness.enable_hooks()
+        relation = self.harness.model.get_relation("controller", self.rel_id)
+        self.harness.charm.on.config_changed.emit()
+        self.harness.charm.on["controller"].relation_changed.emit(
+            relation, relation.app
+        )
+        self.harness.charm.on.update_status.emit()
+        mock_write.assert_called_once()
+        self.assertIn("analyticsEnabled: false", mock_write.call_args.args[1].decode())
+
+    @mock.patch("config._write_atomic")
+    @mock.patch("charm.os.system")
+    def test_reconcile_stats_action(self, mock_system, mock_write):
+        self.harness.charm.on.update_status.emit()
+        before = self.harness.run_action("reconcile-stats").results
+        self.harness.charm.on.update_status.emit()
+        self.harness.charm.on.update_status.emit()
+        after = self.harness.run_action("reconcile-stats").results
+        self.assertEqual(after["avoided"], before["avoided"] + 2)
+        self.assertEqual(after["state-unchanged"], before.get("state-unchanged", 0) + 2)
+
+    @mock.patch("config._write_atomic")
+    @mock.patch("charm.os.system")
+    def test_missing_controller_url(self, mock_system, mock_write):
         # We should fail with a blocked status if the relation data is incomplete.
+        mock_system.return_value = 0
         self.harness.update_relation_data(
             self.rel_id,
             "juju-controller",
@@ -76,6 +222,138 @@ class TestDashboardRelation(unittest.TestCase):
             self.harness.model.unit.status, BlockedStatus("Missing controller URL")
         )
 
+    def _written_files(self, mock_write):
+        return {
+            call.args[0]: call.args[1].decode() for call in mock_write.call_args_list
+        }
+
+    @mock.patch("config._write_atomic")
+    @mock.patch("charm.os.system")
+    def test_controller_ca_cert(self, mock_system, mock_write):
+        mock_system.return_value = 0
+        self.harness.update_relation_data(
+            self.rel_id,
+            "juju-controller",
+            {
+                "controller-url": "wss://10.10.10.1:17070",
+                "ca-cert": "-----BEGIN CERTIFICATE-----",
+            },
+        )
+        written = self._written_files(mock_write)
+        self.assertEqual(
+            written[Path("/etc/nginx/juju-controller-ca.pem")],
+            "-----BEGIN CERTIFICATE-----",
+        )
+        nginx_config = written[Path("/etc/nginx/sites-available/default")]
+        self.assertIn("proxy_ssl_session_reuse on;", nginx_config)
+        self.assertIn(
+            "proxy_ssl_trusted_certificate /etc/nginx/juju-controller-ca.pem;",
+            nginx_config,
+        )
+        self.assertIn("proxy_ssl_verify on;", nginx_config)
+        self.assertIn("proxy_ssl_name juju-apiserver;", nginx_config)
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    @mock.patch("config._write_atomic")
+    @mock.patch("charm.os.system")
+    def test_controller_ca_cert_absent(self, mock_system, mock_write):
+        mock_system.return_value = 0
+        self.harness.update_relation_data(
+            self.rel_id, "juju-controller", {"controller-url": "wss://10.10.10.1:17070"}
+        )
+        written = self._written_files(mock_write)
+        self.assertNotIn(Path("/etc/nginx/juju-controller-ca.pem"), written)
+        nginx_config = written[Path("/etc/nginx/sites-available/default")]
+        self.assertIn("proxy_ssl_session_reuse on;", nginx_config)
+        self.assertNotIn("proxy_ssl_verify", nginx_config)
+        self.assertNotIn("proxy_ssl_trusted_certificate", nginx_config)
+
+    @mock.patch("config._write_atomic")
+    @mock.patch("charm.os.system")
+    def test_controller_ca_cert_rotated(self, mock_system, mock_write):
+        mock_system.return_value = 0
+        self.harness.update_relation_data(
+            self.rel_id,
+            "juju-controller",
+            {
+                "controller-url": "wss://10.10.10.1:17070",
+                "ca-cert": "-----BEGIN CERTIFICATE-----",
+            },
+        )
+        mock_system.reset_mock()
+        mock_write.reset_mock()
+        self.harness.update_relation_data(
+            self.rel_id, "juju-controller", {"ca-cert": "-----NEW CERTIFICATE-----"}
+        )
+        # Only the certificate changed, and nginx is reloaded to use it for new
+        # connections to the controller.
+        self.assertEqual(
+            self._written_files(mock_write),
+            {Path("/etc/nginx/juju-controller-ca.pem"): "-----NEW CERTIFICATE-----"},
+        )
+        mock_system.assert_has_calls(
+            [
+                mock.call("sudo nginx -t"),
+                mock.call("sudo systemctl reload-or-restart nginx"),
+            ]
+        )
+        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+
+    @mock.patch("config._write_atomic")
+    @mock.patch("charm.os.system")
+    def test_drain_timeout(self, mock_system, mock_write):
+        mock_system.return_value = 0
+        self.harness.update_config({"reload-drain-timeout": 60})
+        written = self._written_files(mock_write)
+        # The drain timeout is set in the main nginx.conf, rather than in a snippet that
+        # the stock nginx.conf would include from modules-enabled.
+        self.assertIn(
+            "worker_shutdown_timeout 60s;", written[Path("/etc/nginx/nginx.conf")]
+        )
+        self.assertFalse(
+            [path for path in written if str(path).startswith("/etc/nginx/modules-")]
+        )
+        mock_system.assert_called_with("sudo systemctl reload-or-restart nginx")
+
+    @mock.patch("config._write_atomic")
+    @mock.patch("charm.os.system")
+    def test_preloads_modules_from_manifest(self, mock_system, mock_write):
+        mock_system.return_value = 0
+        manifest = self.config_dir / "dist" / ".vite" / "manifest.json"
+        manifest.parent.mkdir(parents=True)
+        with open(manifest, "w") as f:
+            json.dump(
+                {
+                    "index.html": {
+                        "file": "assets/index-a1.js",
+                        "css": ["assets/index-c3.css"],
+                    }
+                },
+                f,
+            )
+        self.harness.charm.on.update_status.emit()
+        written = self._written_files(mock_write)
+        self.assertIn(
+            'add_header Link "</assets/index-a1.js>; rel=modulepreload; crossorigin, '
+            '</assets/index-c3.css>; rel=preload; as=style";',
+            written[Path("/etc/nginx/sites-available/default")],
+        )
+
+    def test_dashboard_relation_port(self):
+        self.harness.set_leader(True)
+        rel_id = self.harness.add_relation("dashboard", "proxy")
+        self.harness.add_relation_unit(rel_id, "proxy/0")
+        self.harness.update_relation_data(rel_id, "proxy/0", {"ready": "true"})
+        relation = self.harness.model.get_relation("dashboard", rel_id)
+        self.assertEqual(relation.data[self.harness.charm.app]["port"], "8080")
+        self.assertEqual(relation.data[self.harness.charm.unit]["port"], "8080")
+        # The port isn't written again while it is unchanged.
+        with mock.patch("ops.model.RelationDataContent.__setitem__") as mock_setitem:
+            self.harness.charm.on["dashboard"].relation_changed.emit(
+                relation, relation.app
+            )
+        mock_setitem.assert_not_called()
+
     def test_relation_departed(self):
         self.harness.model.unit.status = ActiveStatus()
         self.harness.remove_relation(self.rel_id)
@@ -84,36 +362,130 @@ class TestDashboardRelation(unittest.TestCase):
             BlockedStatus("Missing controller integration"),
         )
 
-    @mock.patch("pathlib.Path.write_text")
+    @mock.patch("config._write_atomic")
     @mock.patch("charm.os.system")
     def test_config_changed(self, mock_system, mock_write):
         ports = self.harness.model.unit.opened_ports()
         self.assertEqual(len(ports), 1)
         self.assertEqual(list(ports)[0].port, 8080)
-        self.assertFalse(
-            self.mock_haproxy_requirer.return_value.provide_haproxy_route_requirements.called
-        )
+        self.mock_haproxy_requirer.return_value.reset_mock()
         self.harness.update_config({"port": 123})
         ports = self.harness.model.unit.opened_ports()
         self.assertEqual(len(ports), 1)
         self.assertEqual(list(ports)[0].port, 123)
         haproxy_instance = self.mock_haproxy_requirer.return_value
-        haproxy_instance.provide_haproxy_route_requirements.assert_called_once_with(
-            "juju-dashboard", ports=[123]
+        routes = [
+            call.kwargs
+            for call in haproxy_instance.provide_haproxy_route_requirements.call_args_list
+        ]
+        self.assertEqual(
+            [route["service"] for route in routes],
+            ["juju-dashboard", "juju-dashboard-websocket"],
         )
+        for route in routes:
+            self.assertEqual(route["ports"], [123])
+            self.assertEqual(route["check_path"], "/healthz")
+            self.assertEqual(route["check_interval"], 10)
+            self.assertEqual(route["check_rise"], 2)
+            self.assertEqual(route["check_fall"], 3)
 
-    @mock.patch("pathlib.Path.write_text")
+    @mock.patch("config._write_atomic")
+    @mock.patch("charm.os.system")
+    def test_haproxy_routes(self, mock_system, mock_write):
+        routes = self.harness.charm._haproxy_routes()
+        # The static route carries the websockets until they have their own route.
+        self.assertEqual(routes["haproxy-route"]["server_timeout"], 3600)
+        self.assertEqual(
+            routes["haproxy-route"]["load_balancing_algorithm"],
+            charm.LoadBalancingAlgorithm.LEASTCONN,
+        )
+        self.assertNotIn("paths", routes["haproxy-route"])
+        self.harness.add_relation("haproxy-route-websocket", "haproxy")
+        routes = self.harness.charm._haproxy_routes()
+        static = routes["haproxy-route"]
+        self.assertEqual(static["server_timeout"], 10)
+        self.assertEqual(
+            static["load_balancing_algorithm"], charm.LoadBalancingAlgorithm.ROUNDROBIN
+        )
+        self.assertEqual(static["retry_count"], 3)
+        self.assertTrue(static["retry_redispatch"])
+        websocket = routes["haproxy-route-websocket"]
+        self.assertEqual(websocket["paths"], ["/api", "/commands", "/model/"])
+        self.assertEqual(websocket["server_timeout"], 3600)
+        self.assertEqual(
+            websocket["load_balancing_algorithm"],
+            charm.LoadBalancingAlgorithm.LEASTCONN,
+        )
+        self.assertIsNone(websocket["server_maxconn"])
+
+    @mock.patch("config._write_atomic")
+    @mock.patch("charm.os.system")
+    def test_health_check(self, mock_system, mock_write):
+        mock_system.return_value = 0
+        self.harness.update_relation_data(
+            self.rel_id,
+            "juju-controller",
+            {"controller-url": "api/some/controller/url", "is-juju": "True"},
+        )
+        written = "".join(self._written_files(mock_write).values())
+        self.assertIn("location = /healthz {", written)
+        self.assertIn('return 200 "OK\\n";', written)
+        mock_write.reset_mock()
+        haproxy_instance = self.mock_haproxy_requirer.return_value
+        haproxy_instance.reset_mock()
+        self.harness.update_config({"health-check-path": ""})
+        written = "".join(self._written_files(mock_write).values())
+        self.assertNotIn("healthz", written)
+        for call in haproxy_instance.provide_haproxy_route_requirements.call_args_list:
+            self.assertNotIn("check_path", call.kwargs)
+
+    @mock.patch("config._write_atomic")
+    @mock.patch("charm.os.system")
+    def test_serves_without_controller(self, mock_system, mock_write):
+        mock_system.return_value = 0
+        harness = Harness(charm.JujuDashboardCharm)
+        self.addCleanup(harness.cleanup)
+        harness.begin_with_initial_hooks()
+        written = "".join(self._written_files(mock_write).values())
+        self.assertIn('controllerAPIEndpoint: "",', written)
+        self.assertIn("location = /healthz {", written)
+        self.assertIn("worker_shutdown_timeout 300s;", written)
+        self.assertNotIn("proxy_pass", written)
+        mock_system.assert_any_call("sudo systemctl reload-or-restart nginx")
+        self.assertEqual(
+            harness.model.unit.status,
+            BlockedStatus("Missing controller integration"),
+        )
+        # The proxy is given the controller once it is related.
+        harness.framework.model._backend.network_get = (
+            lambda endpoint_name, relation_id: FAKE_ENDPOINT
+        )
+        mock_write.reset_mock()
+        rel_id = harness.add_relation("controller", "juju-controller")
+        harness.add_relation_unit(rel_id, "juju-controller/0")
+        harness.update_relation_data(
+            rel_id,
+            "juju-controller",
+            {"controller-url": "wss://10.10.10.1:17070", "is-juju": "True"},
+        )
+        written = "".join(self._written_files(mock_write).values())
+        self.assertIn('controllerAPIEndpoint: "/api",', written)
+        self.assertIn("server 10.10.10.1:17070", written)
+        self.assertEqual(harness.model.unit.status, ActiveStatus())
+
+    @mock.patch("config._write_atomic")
     @mock.patch("charm.os.system")
     def test_config_changed_no_relation(self, mock_system, mock_write):
+        mock_system.return_value = 0
         self.harness.remove_relation(self.rel_id)
         self.harness.model.unit.status = ActiveStatus()
-        self.harness.update_config({"is-juju": True})
+        self.harness.update_config({"analytics-enabled": False})
         self.assertEqual(
             self.harness.model.unit.status,
             BlockedStatus("Missing controller integration"),
         )
 
-    @mock.patch("pathlib.Path.write_text")
+    @mock.patch("config._write_atomic")
     @mock.patch("charm.os.system")
     def test_update_status(self, mock_system, mock_write):
         self.harness.disable_hooks()
@@ -127,7 +499,7 @@ class TestDashboardRelation(unittest.TestCase):
         self.assertEqual(len(ports), 1)
         self.assertEqual(list(ports)[0].port, 123)
 
-    @mock.patch("pathlib.Path.write_text")
+    @mock.patch("config._write_atomic")
     @mock.patch("charm.os.system")
     def test_upgrade_charm(self, mock_system, mock_write):
         self.harness.disable_hooks()
@@ -141,10 +513,12 @@ class TestDashboardRelation(unittest.TestCase):
         self.assertEqual(len(ports), 1)
         self.assertEqual(list(ports)[0].port, 123)
 
-    @mock.patch("pathlib.Path.write_text")
+    @mock.patch("config._write_atomic")
     @mock.patch("charm.os.system")
     def test_could_not_start_nginx(self, mock_system, mock_write):
-        mock_system.return_value = -1
+        mock_system.side_effect = lambda command: (
+            0 if command == "sudo nginx -t" else -1
+        )
 
         self.harness.update_relation_data(
             self.rel_id,
@@ -159,3 +533,166 @@ class TestDashboardRelation(unittest.TestCase):
         self.assertEqual(
             self.harness.model.unit.status, BlockedStatus("Could not start nginx")
         )
+
+
+class TestJujuDashData(unittest.TestCase):
+    def test_controller_urls(self):
+        data = JujuDashData(
+            {"controller-url": "wss://juju-0.example:17070/api"},
+            [{"ingress-address": "10.10.10.1"}, {"ingress-address": "fd00::2"}],
+        )
+        # The controller URL names one of the units, so only the unit addresses are used.
+        self.assertEqual(
+            data["controller_urls"],
+            ["wss://10.10.10.1:17070", "wss://[fd00::2]:17070"],
+        )
+
+    def test_controller_urls_without_unit_addresses(self):
+        data = JujuDashData({"controller-url": "wss://juju-0.example:17070/api"}, [{}])
+        self.assertEqual(data["controller_urls"], ["wss://juju-0.example:17070"])
+
+
+class TestConfigWrite(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.root = Path(self.tempdir.name)
+        for template in SRC_DIR.glob("*.j2"):
+            shutil.copy(template, self.root)
+        (self.root / "dist").mkdir()
+
+    def _write_config_js(self, analytics_enabled):
+        Config(
+            config_dir=str(self.root),
+            controller_url="wss://10.10.10.1:17070",
+            identity_provider_url=None,
+            is_juju=True,
+            dashboard_root=str(self.root / "dist"),
+            analytics_enabled=analytics_enabled,
+            port=8080,
+        ).write(write_nginx=False, write_controller_ca=False, write_main_nginx=False)
+
+    def test_config_js_replaced(self):
+        config_js = self.root / "dist" / "config.js"
+        self._write_config_js(analytics_enabled=True)
+        inode = config_js.stat().st_ino
+        self._write_config_js(analytics_enabled=False)
+        # nginx may have the previous file open in its cache, so it is replaced rather
+        # than rewritten in place.
+        self.assertNotEqual(config_js.stat().st_ino, inode)
+        self.assertIn("analyticsEnabled: false", config_js.read_text())
+        self.assertEqual(
+            sorted(path.name for path in (self.root / "dist").iterdir()),
+            ["config.js"],
+        )
+
+
+class TestCompressAssets(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.root = Path(self.tempdir.name)
+        (self.root / "assets").mkdir()
+        self.script = self.root / "assets" / "index-abc123.js"
+        self.script.write_text("console.log('dashboard');\n" * 100)
+        (self.root / "assets" / "small.js").write_text("1;")
+        (self.root / "assets" / "icon.png").write_bytes(b"\x89PNG" * 1000)
+
+    def test_compress_assets(self):
+        compress_assets(str(self.root), static_gzip_level=9)
+        compressed = self.root / "assets" / "index-abc123.js.gz"
+        self.assertEqual(
+            gzip.decompress(compressed.read_bytes()).decode(), self.script.read_text()
+        )
+        self.assertFalse((self.root / "assets" / "small.js.gz").exists())
+        self.assertFalse((self.root / "assets" / "icon.png.gz").exists())
+
+    def test_compress_assets_cached(self):
+        compress_assets(str(self.root), static_gzip_level=9)
+        with mock.patch("config.gzip.compress") as mock_compress:
+            compress_assets(str(self.root), static_gzip_level=9)
+        mock_compress.assert_not_called()
+
+    def test_compress_assets_disabled(self):
+        compress_assets(str(self.root), static_gzip_level=9)
+        compress_assets(str(self.root), static_gzip_level=0)
+        self.assertFalse((self.root / "assets" / "index-abc123.js.gz").exists())
+
+
+class TestPreloadAssets(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.root = Path(self.tempdir.name)
+
+    def test_preload_assets(self):
+        (self.root / ".vite").mkdir()
+        (self.root / ".vite" / "manifest.json").write_text(
+            json.dumps(
+                {
+                    "index.html": {
+                        "file": "assets/index-a1.js",
+                        "imports": ["_vendor-b2.js", "_shared-e5.js"],
+                        "dynamicImports": ["src/lazy.tsx"],
+                        "css": ["assets/index-c3.css"],
+                    },
+                    "_vendor-b2.js": {
+                        "file": "assets/vendor-b2.js",
+                        "imports": ["_shared-e5.js"],
+                    },
+                    "_shared-e5.js": {"file": "assets/shared-e5.js"},
+                    "src/lazy.tsx": {"file": "assets/lazy-d4.js"},
+                }
+            )
+        )
+        self.assertEqual(
+            preload_assets(str(self.root), "index.html"),
+            {
+                "modules": [
+                    "assets/index-a1.js",
+                    "assets/vendor-b2.js",
+                    "assets/shared-e5.js",
+                ],
+                "styles": ["assets/index-c3.css"],
+            },
+        )
+
+    def test_preload_assets_without_manifest(self):
+        self.assertEqual(
+            preload_assets(str(self.root), "index.html"),
+            {"modules": [], "styles": []},
+        )
+
+    def test_preload_link(self):
+        preloads = {
+            "modules": ["assets/index-a1.js"],
+            "styles": ["assets/index-c3.css"],
+        }
+        for base_app_url in ("", "/", "/juju-dashboard", "/juju-dashboard/"):
+            prefix = base_app_url.rstrip("/")
+            with self.subTest(base_app_url=base_app_url):
+                self.assertEqual(
+                    preload_link(preloads, base_app_url),
+                    f"<{prefix}/assets/index-a1.js>; rel=modulepreload; crossorigin, "
+                    f"<{prefix}/assets/index-c3.css>; rel=preload; as=style",
+                )
+
+
+class TestWorkerSettings(unittest.TestCase):
+    def test_worker_settings_unlimited(self):
+        self.assertEqual(
+            worker_settings("max 100000\n", "max\n", 16),
+            {"processes": 16, "connections": 4096, "rlimit_nofile": 8192},
+        )
+
+    def test_worker_settings_limited(self):
+        self.assertEqual(
+            worker_settings("50000 100000\n", str(32 * 1024 * 1024), 16),
+            {"processes": 1, "connections": 512, "rlimit_nofile": 1024},
+        )
+
+    def test_worker_settings_overridden(self):
+        self.assertEqual(
+            worker_settings(None, None, 2, processes=8, rlimit_nofile=65536),
+            {"processes": 8, "connections": 4096, "rlimit_nofile": 65536},
+        )
@@ -33,6 +33,8 @@ export default defineConfig(({ mode }) => {
     build: {
       outDir: "build",
       cssMinify: "esbuild",
+      // The charms read the manifest to preload the app's modules.
+      manifest: true,
     },
     css: {
       devSourcemap: true,